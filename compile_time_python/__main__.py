@@ -1,4 +1,17 @@
-from compile import main
+import sys
+from server import run_client, serve
 
 if __name__ == "__main__":
+    if sys.argv[1:] == ["--server"]:
+        serve()
+    if len(sys.argv) == 3 and sys.argv[1] == "--batch":
+        from batch import run_batch
+
+        sys.exit(run_batch(sys.argv[2]))
+    exit_status = run_client()
+    if exit_status is not None:
+        sys.exit(exit_status)
+    # imported here because it is unnecessary if a dcc server compiles the program
+    from compile import main
+
     main()
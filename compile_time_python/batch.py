@@ -0,0 +1,167 @@
+# dcc --batch manifest.json compiles many programs, e.g. submissions for an autograder,
+# in one dcc invocation using a pool of worker processes
+#
+# the manifest is a JSON list of jobs, or an object {"jobs": [...], "workers": n}
+# each job is an object:
+#
+#   "sources" - list of source files
+#   "flags"   - list of dcc/clang arguments (optional)
+#   "output"  - pathname for the executable (optional, default a.out)
+#   "cwd"     - directory for the compilation (optional, default the manifest's directory)
+#   "id"      - copied to the job's result (optional)
+#
+# a job with invalid fields is not compiled, its result has exit status 1
+#
+# a JSON object is printed on stdout, on one line, as each job finishes:
+#
+#   "job"                - the job's index in the manifest
+#   "id"                 - the job's id, if it has one
+#   "argv"               - the dcc arguments for the job
+#   "exit_status"        - dcc's exit status
+#   "compiler_output"    - the compiler's output
+#   "explanation_labels" - labels of the explanations of the compiler output
+#   "messages"           - what dcc printed, i.e. compiler output with explanations
+#                          followed by anything its subprocesses wrote to stdout
+#
+# the first job is compiled before the others are started,
+# so the wrapper code it compiles & the toolchain probe results are in the cache
+# and are reused by the other jobs
+
+import contextlib, io, json, multiprocessing, os, sys, tempfile
+from compile import add_dcc_directories_to_path, compile_and_explain
+from options import get_options
+from profiling import reset_profile
+
+
+def run_batch(manifest_pathname):
+    """
+    compile the jobs in manifest_pathname, return an exit status
+    """
+    try:
+        with open(manifest_pathname, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"dcc: can not read {manifest_pathname}: {e}", file=sys.stderr)
+        return 1
+    if isinstance(manifest, dict):
+        jobs = manifest.get("jobs", [])
+        n_workers = manifest.get("workers", 0)
+    else:
+        jobs = manifest
+        n_workers = 0
+    if not isinstance(jobs, list) or not all(isinstance(j, dict) for j in jobs):
+        print(f"dcc: {manifest_pathname}: jobs must be objects", file=sys.stderr)
+        return 1
+    n_workers = n_workers or os.cpu_count() or 1
+    directory = os.path.dirname(os.path.abspath(manifest_pathname))
+    add_dcc_directories_to_path()
+
+    work = [(job_number, job, directory) for (job_number, job) in enumerate(jobs)]
+    if not work:
+        return 0
+    print_result(run_job(work[0]))
+    if len(work) > 1:
+        # fork, so workers inherit dcc's loaded modules
+        context = multiprocessing.get_context("fork")
+        with context.Pool(min(n_workers, len(work) - 1)) as pool:
+            for result in pool.imap_unordered(run_job, work[1:]):
+                print_result(result)
+    return 0
+
+
+def print_result(result):
+    print(json.dumps(result), flush=True)
+
+
+def run_job(work):
+    """
+    compile one job from the manifest, return its result
+    """
+    job_number, job, directory = work
+    result = {"job": job_number}
+    if "id" in job:
+        result["id"] = job["id"]
+    error = check_job(job)
+    if error:
+        result["argv"] = []
+        result["exit_status"] = 1
+        result["compiler_output"] = ""
+        result["explanation_labels"] = []
+        result["messages"] = f"dcc: job {job_number}: {error}\n"
+        return result
+    output = job.get("output", "a.out")
+    argv = job.get("flags", []) + job.get("sources", []) + ["-o", output]
+    result["argv"] = argv
+
+    messages = io.StringIO()
+    exit_status = 1
+    compiler_output = ""
+    explanation_labels = []
+    original_argv = sys.argv
+    original_directory = os.getcwd()
+    try:
+        # the argument parsing & logging code read sys.argv
+        sys.argv = [sys.argv[0]] + argv
+        reset_profile(argv)
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(contextlib.redirect_stderr(messages))
+            stack.enter_context(contextlib.redirect_stdout(messages))
+            stack.enter_context(redirect_stdout_fd(messages))
+            os.chdir(os.path.join(directory, job.get("cwd", "")))
+            options = get_options()
+            p, explanation_labels = compile_and_explain(options)
+            if p:
+                exit_status = p.returncode
+                compiler_output = p.stdout or ""
+    except SystemExit as e:
+        # get_options exits for errors & for arguments such as --help
+        if e.code is None or isinstance(e.code, int):
+            exit_status = e.code or 0
+        else:
+            messages.write(str(e.code) + "\n")
+    except OSError as e:
+        messages.write(f"dcc: {e}\n")
+    except Exception as e:
+        # one job's failure should not stop the batch
+        messages.write(f"dcc: internal error: {type(e).__name__}: {e}\n")
+    finally:
+        sys.argv = original_argv
+        os.chdir(original_directory)
+    result["exit_status"] = exit_status
+    result["compiler_output"] = compiler_output
+    result["explanation_labels"] = explanation_labels
+    result["messages"] = messages.getvalue()
+    return result
+
+
+@contextlib.contextmanager
+def redirect_stdout_fd(messages):
+    """
+    send what subprocesses, e.g. the compile helper, write to file descriptor 1
+    to messages, so it is not mixed with the results printed on stdout
+    """
+    sys.__stdout__.flush()
+    saved_fd = os.dup(1)
+    with tempfile.TemporaryFile() as f:
+        os.dup2(f.fileno(), 1)
+        try:
+            yield
+        finally:
+            os.dup2(saved_fd, 1)
+            os.close(saved_fd)
+            f.seek(0)
+            messages.write(f.read().decode("utf-8", errors="replace"))
+
+
+def check_job(job):
+    """
+    return a description of what is wrong with job's fields, None if they are valid
+    """
+    for field in ["sources", "flags"]:
+        value = job.get(field, [])
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            return f'"{field}" must be a list of strings'
+    for field in ["output", "cwd"]:
+        if not isinstance(job.get(field, ""), str):
+            return f'"{field}" must be a string'
+    return None
@@ -0,0 +1,260 @@
+# persistent content-addressed cache of build products shared between dcc invocations
+#
+# entries are stored as <cache_directory>/<first 2 hex digits of key>/<key><suffix>
+# entries are written atomically by renaming a temporary file in the same directory
+# so concurrent dcc processes never see a partially written entry
+#
+# an entry's modification time is updated when it is used
+# and the least recently used entries are removed when the cache exceeds its maximum size
+#
+# a running total of the size of the entries is kept in a file in the cache directory
+# so the cache is only scanned when the total exceeds the maximum size
+#
+# options.system_cache_directory is consulted, read-only, if an entry is not in options.cache_directory
+# it allows a system administrator to pre-populate a cache shared by all users
+
+import fcntl, hashlib, os, shutil, stat, tempfile, time
+from util import search_path
+
+# temporary files left by killed dcc processes are removed after this many seconds
+STALE_TEMPORARY_FILE_SECONDS = 3600
+
+CACHE_SIZE_BASENAME = "size"
+
+# when the cache exceeds its maximum size, entries are removed until it is
+# this fraction of the maximum size, so it is not scanned again by the next insertion
+EVICTION_TARGET_FRACTION = 0.9
+
+
+def cache_key(*components):
+    """
+    return a hex digest of components, which may be str, bytes or (nested) lists of these
+    """
+    h = hashlib.sha256()
+    _hash_components(h, components)
+    return h.hexdigest()
+
+
+def _hash_components(h, components):
+    for component in components:
+        if isinstance(component, (list, tuple)):
+            h.update(b"[%d" % len(component))
+            _hash_components(h, component)
+            continue
+        if not isinstance(component, bytes):
+            component = str(component).encode("utf-8", errors="surrogateescape")
+        # length prefix so component boundaries are part of the hash
+        h.update(b"%d:" % len(component))
+        h.update(component)
+
+
+def program_identity(program):
+    """
+    return a string which changes if the program found for program in $PATH is changed
+    """
+    pathname = program if os.path.isabs(program) else search_path(program)
+    if not pathname:
+        return program
+    try:
+        pathname = os.path.realpath(pathname)
+        s = os.stat(pathname)
+        return f"{pathname}:{s.st_dev}:{s.st_ino}:{s.st_size}:{s.st_mtime_ns}"
+    except OSError:
+        return program
+
+
+def cache_lookup(options, key, suffix=""):
+    """
+    return pathname of cache entry for key, None if there is no entry
+    """
+    for directory in [options.cache_directory, options.system_cache_directory]:
+        if not directory:
+            continue
+        pathname = _entry_pathname(directory, key, suffix)
+        if not os.path.isfile(pathname):
+            continue
+        if directory == options.cache_directory:
+            try:
+                # record use for LRU eviction
+                os.utime(pathname)
+            except OSError:
+                pass
+        options.debug_print("cache hit", pathname, level=2)
+        return pathname
+    options.debug_print("cache miss", key + suffix, level=2)
+    return None
+
+
+def cache_fetch(options, key, destination, suffix=""):
+    """
+    copy cache entry for key to destination, return True if there was an entry
+    """
+    pathname = cache_lookup(options, key, suffix)
+    if not pathname:
+        return False
+    # copy rather than link, the destination might be modified
+    # and replace atomically, the destination might be a running executable
+    temporary_pathname = None
+    try:
+        directory = os.path.dirname(os.path.abspath(destination))
+        fd, temporary_pathname = tempfile.mkstemp(dir=directory, prefix=".dcc")
+        os.close(fd)
+        shutil.copy(pathname, temporary_pathname)
+        os.replace(temporary_pathname, destination)
+        return True
+    except OSError as e:
+        options.debug_print("cache_fetch", pathname, e)
+        if temporary_pathname:
+            _unlink(temporary_pathname)
+        return False
+
+
+def cache_insert(options, key, source_pathname=None, contents=None, suffix=""):
+    """
+    atomically add a copy of source_pathname, or the bytes contents, as the cache entry for key
+    return True if the entry was added
+    """
+    if not options.cache_directory:
+        return False
+    pathname = _entry_pathname(options.cache_directory, key, suffix)
+    directory = os.path.dirname(pathname)
+    temporary_pathname = None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary_pathname = tempfile.mkstemp(dir=directory, prefix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            if contents is None:
+                with open(source_pathname, "rb") as source:
+                    shutil.copyfileobj(source, f)
+            else:
+                f.write(contents)
+        # mkstemp creates files only readable by the owner
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666
+        if source_pathname:
+            mode = stat.S_IMODE(os.stat(source_pathname).st_mode)
+        os.chmod(temporary_pathname, mode & ~umask)
+        added_bytes = os.stat(temporary_pathname).st_size - _file_size(pathname)
+        os.replace(temporary_pathname, pathname)
+        temporary_pathname = None
+        options.debug_print("cache insert", pathname, level=2)
+    except OSError as e:
+        options.debug_print("cache_insert", pathname, e)
+        return False
+    finally:
+        if temporary_pathname:
+            _unlink(temporary_pathname)
+    total_bytes = _update_cache_size(options.cache_directory, added_bytes)
+    if total_bytes is None or total_bytes > options.cache_max_bytes:
+        cache_evict(options.cache_directory, options.cache_max_bytes, options)
+    return True
+
+
+def cache_evict(directory, max_bytes, options):
+    """
+    if the cache is larger than max_bytes, remove least recently used entries
+    until it is no larger than EVICTION_TARGET_FRACTION of max_bytes
+    and record the cache's size
+    """
+    entries = []
+    total_bytes = 0
+    now = time.time()
+    try:
+        subdirectories = list(os.scandir(directory))
+    except OSError:
+        return
+    for subdirectory in subdirectories:
+        try:
+            if not subdirectory.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(subdirectory.path):
+                s = entry.stat(follow_symlinks=False)
+                if entry.name.startswith(".tmp"):
+                    if now - s.st_mtime > STALE_TEMPORARY_FILE_SECONDS:
+                        _unlink(entry.path)
+                    continue
+                entries.append((s.st_mtime, s.st_size, entry.path))
+                total_bytes += s.st_size
+        except OSError:
+            continue
+    if total_bytes > max_bytes:
+        entries.sort()
+        for _, size, pathname in entries:
+            if total_bytes <= max_bytes * EVICTION_TARGET_FRACTION:
+                break
+            options.debug_print("cache evict", pathname, level=2)
+            _unlink(pathname)
+            total_bytes -= size
+    # entries inserted by other dcc processes during the scan may be missed
+    # but will be counted by the next scan
+    _update_cache_size(directory, total_bytes, replace=True)
+
+
+def _update_cache_size(directory, added_bytes, replace=False):
+    """
+    add added_bytes to the cache size recorded in directory, or replace it if replace
+    return the new size, None if the size is not known
+    """
+    pathname = os.path.join(directory, CACHE_SIZE_BASENAME)
+    try:
+        fd = os.open(pathname, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError:
+        return None
+    try:
+        # the file is locked so concurrent dcc processes don't lose updates
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if replace:
+            total_bytes = added_bytes
+        else:
+            try:
+                total_bytes = int(os.read(fd, 64)) + added_bytes
+            except ValueError:
+                # a new cache, or one created by an older dcc, has to be scanned
+                return None
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, b"%d\n" % total_bytes)
+        return total_bytes
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def write_file_atomically(pathname, contents):
+    """
+    replace pathname with a file containing the bytes contents, readable by all users
+    the file is replaced atomically so concurrent dcc processes can read it
+    raises OSError if pathname can not be written
+    """
+    directory = os.path.dirname(pathname)
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary_pathname = tempfile.mkstemp(dir=directory, prefix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(contents)
+        # mkstemp creates files only readable by the owner
+        os.chmod(temporary_pathname, 0o644)
+        os.replace(temporary_pathname, pathname)
+    except OSError:
+        _unlink(temporary_pathname)
+        raise
+
+
+def _entry_pathname(directory, key, suffix):
+    return os.path.join(directory, key[0:2], key + suffix)
+
+
+def _file_size(pathname):
+    try:
+        return os.stat(pathname).st_size
+    except OSError:
+        return 0
+
+
+def _unlink(pathname):
+    try:
+        os.unlink(pathname)
+    except OSError:
+        pass
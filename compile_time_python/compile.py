@@ -1,9 +1,30 @@
-import io, json, os, pkgutil, platform, re, subprocess, sys, tarfile, tempfile
+import codecs, concurrent.futures, io, json, locale, os, pkgutil, platform, re, select, subprocess, sys, tarfile, tempfile, threading
 import colors
 
 from version import VERSION
 from options import get_options
-from explain_compiler_output import explain_compiler_output
+from serialized_diagnostics import (
+    read_serialized_diagnostics,
+    diagnostics_from_json,
+    diagnostics_to_json,
+)
+from cache import (
+    cache_fetch,
+    cache_insert,
+    cache_key,
+    cache_lookup,
+    program_identity,
+)
+from profiling import (
+    phase,
+    profile_results,
+    profiled,
+    profiled_popen,
+    record_subprocess,
+    reset_profile,
+    start_subprocess_record,
+    write_profile,
+)
 
 FILES_EMBEDDED_IN_BINARY = [
     "drive_gdb.py",
@@ -27,38 +48,94 @@ WRAPPER_SOURCE_COMPILER_ARGS = """
 
 DEBUG_COMPILE_FILE = "tmp_dcc.sh"
 
+# created by the Makefile using write_runtime_tarfile
+RUNTIME_TARFILE = "runtime.tar.xz"
+
+# links the contents of a file into the program, see embed_data_file
+EMBEDDED_DATA_ASSEMBLER = """\
+\t.section .rodata.dcc_{name},"a"
+\t.balign 16
+\t.globl __dcc_{name}
+\t.hidden __dcc_{name}
+__dcc_{name}:
+\t.incbin "{pathname}"
+__dcc_{name}_end:
+\t.balign 8
+\t.globl __dcc_{name}_n_bytes
+\t.hidden __dcc_{name}_n_bytes
+__dcc_{name}_n_bytes:
+\t.quad __dcc_{name}_end - __dcc_{name}
+\t.section .note.GNU-stack,"",%progbits
+"""
+
+SOURCE_FILE_SUFFIXES = [".c", ".cpp", ".cc", ".cxx", ".c++", ".C"]
+
+# an error message from gcc is assumed complete if its caret line has been seen
+# and no more compiler output arrives for this long,
+# clang's error messages are always followed by another line
+ERROR_MESSAGE_QUIET_SECONDS = 0.2
+
+# compiler output indicating a precompiled header was rejected
+PRECOMPILED_HEADER_ERRORS = ["precompiled header", "PCH file", "AST file"]
+
 
 #
 # Compile the user's program adding some C code
 #
 def main():
+    reset_profile(sys.argv[1:])
+    add_dcc_directories_to_path()
+    with phase("get_options"):
+        options = get_options()
+    p, _ = compile_and_explain(options)
+    write_profile(options)
+    if p:
+        sys.exit(p.returncode)
+    else:
+        sys.exit(1)
+
+
+def add_dcc_directories_to_path():
     os.environ["PATH"] = (
         os.path.dirname(os.path.realpath(sys.argv[0]))
         + ":/bin:/usr/bin:/usr/local/bin:/sbin:/usr/sbin:"
         + os.environ.get("PATH", "")
     )
-    options = get_options()
+
+
+def compile_and_explain(options):
+    """
+    compile the user's program, printing the compiler output with explanations
+    return the compiler process & the labels of the explanations
+    """
     with tempfile.TemporaryDirectory(prefix="dcc") as d:
         options.temporary_directory = d
-        p = compile_user_program(options)
+        build_key = get_build_cache_key(options)
+        p = fetch_cached_build(build_key, options)
+        if not p:
+            p = compile_user_program(options)
+            cache_build(build_key, p, options)
         explanation_labels = []
-        if p.stdout:
+        if p and p.stdout:
             if options.explanations:
-                explanations = explain_compiler_output(p.stdout, options)
+                # imported here because most compiles produce no output to explain
+                # and compiler_explanations is large
+                from explain_compiler_output import explain_compiler_output
+
+                with phase("explain_compiler_output"):
+                    explanations = explain_compiler_output(
+                        p.stdout, options, getattr(p, "diagnostics", None)
+                    )
                 explanation_labels = [e.label for e in explanations if e and e.label]
             else:
                 print(p.stdout, end="", file=sys.stderr)
         if p:
             run_compile_time_logger(p, explanation_labels, options)
-            sys.exit(p.returncode)
-        else:
-            sys.exit(1)
+        return p, explanation_labels
 
 
+@profiled
 def compile_user_program(options):
-    wrapper_source, tar_source, wrapper_cpp_source = get_wrapper_code(options)
-    executable_source = ""
-
     if options.debug > 1:
         try:
             options.debug_print(f"Leaving dcc compile_command in {DEBUG_COMPILE_FILE}")
@@ -68,47 +145,49 @@ def compile_user_program(options):
         except OSError:
             pass
 
-    if len(options.sanitizers) == 2:
-        sanitizer2_wrapper_source, sanitizer2_sanitizer_args = update_wrapper_source(
-            options.sanitizers[1], 2, wrapper_source, tar_source, options
-        )
-        sanitizer2_wrapper_source = (
-            "#undef _GNU_SOURCE\n#define _GNU_SOURCE 1\n#include <stdint.h>\n"
-            + sanitizer2_wrapper_source
-        )
-        try:
-            # can't use tempfile.NamedTemporaryFile because may be multiple opens of file
-            executable = tempfile.mkstemp(prefix="dcc_sanitizer2")[1]
-            p = execute_compiler(
-                options.c_compiler,
-                options.dcc_supplied_compiler_args
-                + sanitizer2_sanitizer_args
-                + ["-o", executable],
-                options,
-                wrapper_C_source=sanitizer2_wrapper_source,
-                wrapper_cpp_source=wrapper_cpp_source,
-                wrapper_extra_options=[opt for opt in sanitizer2_sanitizer_args if opt.startswith("-f")],
-                debug_C_wrapper_file="tmp_dcc_sanitizer2.c",
-            )
-            if p.returncode != 0:
-                return p
-            with open(executable, "rb") as f:
-                (
-                    executable_n_bytes,
-                    executable_source,
-                ) = source_for_sanitizer2_executable(f.read())
-            os.unlink(executable)
-        except OSError:
-            # compiler may unlink temporary file resulting in this exception
-            return None
+    # gcc picks up some errors at compile-time that clang doesn't, e.g
+    # int main(void) {int a[1]; return a[0];}
+    # so run gcc as well if available
+    #
+    # gcc is run in the background while clang compiles the program
+    # its output is only used if clang produces no output
+
+    gcc_process = None
+    if (
+        "gcc" not in options.c_compiler
+        and not options.object_files_being_linked
+        and not options.incremental_compilation
+        and options.also_run_gcc
+    ):
+        gcc_process = start_gcc_checking(options)
+
+    # explanations stop at the first error, so once the compiler outputs an error
+    # the rest of the build can not change what is shown, and is stopped
+    if options.explanations:
+        options.error_monitor = ErrorMonitor()
+
+    p = compile_with_clang(options)
+    if options.error_monitor and options.error_monitor.failed_process:
+        # the compile which output the error, not one stopped because of it
+        p = options.error_monitor.failed_process
+
+    if not gcc_process:
+        return p
+    if not p or p.returncode != 0 or p.stdout:
+        options.debug_print("clang produced output, stopping gcc")
+        finish(gcc_process, options, kill=True)
+        return p
+    return finish_gcc_checking(gcc_process, options)
 
-    # leave leak checking to valgrind if it is running
-    # because it currently gives better errors
-    wrapper_source, sanitizer_args = update_wrapper_source(
-        options.sanitizers[0], 1, wrapper_source, tar_source, options
-    )
 
+@profiled
+def compile_with_clang(options):
     if options.incremental_compilation:
+        # no executable is built so the wrapper code & the archive of sources
+        # are not needed
+        sanitizer_args = get_sanitizer_args(
+            options.sanitizers[0], 1, options, linking=False
+        )
         incremental_compilation_args = (
             sanitizer_args
             + options.dcc_supplied_compiler_args
@@ -118,13 +197,84 @@ def compile_user_program(options):
         if options.object_pathname != "a.out":
             command += ["-o", options.object_pathname]
         options.debug_print("incremental compilation, running: ", " ".join(command))
-        return subprocess.run(command)
+        before = start_subprocess_record()
+        with profiled_popen(command) as process:
+            process.wait()
+        record_subprocess(command, process.returncode, before, process)
+        return subprocess.CompletedProcess(command, process.returncode)
+
+    wrapper_source, tar_source, tar_objects, wrapper_cpp_source = get_wrapper_code(
+        options
+    )
+    executable_source = ""
+    executable_objects = []
+
+    # leave leak checking to valgrind if it is running
+    # because it currently gives better errors
+    sanitizer1_wrapper_source, sanitizer_args = update_wrapper_source(
+        options.sanitizers[0], 1, wrapper_source, tar_source, options
+    )
 
-    if executable_source:
-        wrapper_source = wrapper_source.replace(
-            "__EXECUTABLE_N_BYTES__", str(executable_n_bytes)
+    compiled_sources = None
+    if len(options.sanitizers) == 2:
+        sanitizer2_wrapper_source, sanitizer2_args = update_wrapper_source(
+            options.sanitizers[1], 2, wrapper_source, tar_source, options
         )
-        wrapper_source = executable_source + wrapper_source
+        # the user's code is compiled for both sanitizers concurrently,
+        # one translation unit per compiler invocation,
+        # then sanitizer2 is linked, as the link of sanitizer1 needs its executable
+        #
+        # the front end can not be run once for both sanitizers,
+        # as it inserts the undefined behaviour checks & marks the functions
+        # which the address & memory sanitizer passes instrument
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            sanitizer1_compile = None
+            sanitizer2_compile = None
+            if get_user_sources(options):
+                sanitizer2_compile = executor.submit(
+                    compile_user_sources,
+                    options.c_compiler,
+                    options.dcc_supplied_compiler_args + sanitizer2_args,
+                    options,
+                    object_prefix="sanitizer2",
+                )
+                sanitizer1_compile = executor.submit(
+                    compile_user_sources,
+                    options.c_compiler,
+                    options.dcc_supplied_compiler_args + sanitizer_args,
+                    options,
+                    object_prefix="sanitizer1",
+                )
+            sanitizer2_build = executor.submit(
+                build_sanitizer2_executable,
+                sanitizer2_wrapper_source,
+                sanitizer2_args,
+                tar_objects,
+                wrapper_cpp_source,
+                options,
+                sanitizer2_compile,
+            )
+            p, executable_source, executable_objects = sanitizer2_build.result()
+            if not executable_source:
+                return p
+            if sanitizer1_compile:
+                compiled_sources = sanitizer1_compile.result()
+                if compiled_sources[0].returncode != 0:
+                    return compiled_sources[0]
+
+    if len(options.sanitizers) == 1 and len(get_user_sources(options)) > 1:
+        # each translation unit is compiled separately
+        # so the object files of unchanged files can be fetched from the cache
+        compiled_sources = compile_user_sources(
+            options.c_compiler,
+            options.dcc_supplied_compiler_args + sanitizer_args,
+            options,
+            object_prefix="sanitizer1",
+        )
+        if compiled_sources[0].returncode != 0:
+            return compiled_sources[0]
+
+    wrapper_source = executable_source + sanitizer1_wrapper_source
 
     # _GNU_SOURCE to get fopencookie
     wrapper_source = (
@@ -140,33 +290,268 @@ def compile_user_program(options):
         wrapper_C_source=wrapper_source,
         wrapper_extra_options=[opt for opt in sanitizer_args if opt.startswith("-f")],
         wrapper_cpp_source=wrapper_cpp_source,
+        embedded_data_objects=tar_objects + executable_objects,
+        compiled_sources=compiled_sources,
     )
-    if p.returncode != 0 or p.stdout:
-        return p
+    return p
 
-    # gcc picks up some errors at compile-time that clang doesn't, e.g
-    # int main(void) {int a[1]; return a[0];}
-    # so run gcc as well if available
 
-    if (
-        options.also_run_gcc
-        and "gcc" not in options.c_compiler
-        and not options.object_files_being_linked
-    ):
-        options.debug_print("compiling with gcc for extra checking")
-        return execute_compiler(
-            "g++" if options.cpp_mode else "gcc",
-            options.gcc_args,
+def start_gcc_checking(options):
+    command = (
+        ["g++" if options.cpp_mode else "gcc"]
+        + options.gcc_args
+        + options.user_supplied_compiler_args
+        + options.dcc_supplied_linker_args
+    )
+    options.debug_print("compiling with gcc for extra checking")
+    if options.debug > 1:
+        append_debug_compile(command)
+    return start(command, options)
+
+
+def finish_gcc_checking(gcc_process, options):
+    p = finish(gcc_process, options)
+    check_for_main(p)
+    return p
+
+
+@profiled
+def build_sanitizer2_executable(
+    sanitizer2_wrapper_source,
+    sanitizer2_sanitizer_args,
+    tar_objects,
+    wrapper_cpp_source,
+    options,
+    sanitizer2_compile=None,
+):
+    """
+    build the executable run by sanitizer2
+    sanitizer2_compile, if supplied, is a future for the result of compile_user_sources
+    return compiler process and the C source & object files embedding the executable
+    the C source is empty if the build failed
+    """
+    sanitizer2_wrapper_source = (
+        "#undef _GNU_SOURCE\n#define _GNU_SOURCE 1\n#include <stdint.h>\n"
+        + sanitizer2_wrapper_source
+    )
+    compiled_sources = None
+    if sanitizer2_compile:
+        compiled_sources = sanitizer2_compile.result()
+        if compiled_sources[0].returncode != 0:
+            return compiled_sources[0], "", []
+    try:
+        executable = os.path.join(options.temporary_directory, "sanitizer2_executable")
+        p = execute_compiler(
+            options.c_compiler,
+            options.dcc_supplied_compiler_args
+            + sanitizer2_sanitizer_args
+            + ["-o", executable],
             options,
-            rename_functions=False,
+            wrapper_C_source=sanitizer2_wrapper_source,
+            wrapper_cpp_source=wrapper_cpp_source,
+            wrapper_extra_options=[
+                opt for opt in sanitizer2_sanitizer_args if opt.startswith("-f")
+            ],
+            debug_C_wrapper_file="tmp_dcc_sanitizer2.c",
+            debug_cpp_wrapper_file="tmp_dcc_sanitizer2.cpp",
+            embedded_data_objects=tar_objects,
+            compiled_sources=compiled_sources,
+        )
+        if p.returncode != 0:
+            return p, "", []
+        executable_source, executable_objects = embed_data_file(
+            "sanitizer2_executable", executable, options
+        )
+        return p, executable_source, executable_objects
+    except OSError:
+        # compiler may unlink temporary file resulting in this exception
+        return None, "", []
+
+
+# environment variables read by the compiler or linker
+# which may change the result of a compilation, e.g. the files included or linked,
+# or the language of compiler messages
+BUILD_ENVIRONMENT_VARIABLES = [
+    "PATH",
+    "CPATH",
+    "C_INCLUDE_PATH",
+    "CPLUS_INCLUDE_PATH",
+    "LIBRARY_PATH",
+    "COMPILER_PATH",
+    "GCC_EXEC_PREFIX",
+    "CCC_OVERRIDE_OPTIONS",
+    "SDKROOT",
+    "MACOSX_DEPLOYMENT_TARGET",
+    "SOURCE_DATE_EPOCH",
+    "LANG",
+    "LANGUAGE",
+    "LC_ALL",
+    "LC_CTYPE",
+    "LC_MESSAGES",
+]
+
+# DCC_ environment variables which do not change the result of a compilation,
+# all others are assumed to, variables starting with DCC_LOGGER_ are set by dcc
+NON_BUILD_DCC_ENVIRONMENT_VARIABLES = [
+    "DCC_CACHE_DIR",
+    "DCC_CACHE_MAX_BYTES",
+    "DCC_SYSTEM_CACHE_DIR",
+    "DCC_NO_BUILD_CACHE",
+    "DCC_COMPILE_LOGGER",
+    "DCC_PROFILE",
+    "DCC_NO_SERVER",
+    "DCC_SERVER_SOCKET",
+    "DCC_SERVER_WORKERS",
+]
+
+
+def get_build_environment():
+    """
+    return the names & values of environment variables
+    which may change the result of a compilation
+    """
+    return sorted(
+        (name, value)
+        for (name, value) in os.environ.items()
+        if name in BUILD_ENVIRONMENT_VARIABLES
+        or (
+            name.startswith("DCC_")
+            and name not in NON_BUILD_DCC_ENVIRONMENT_VARIABLES
+            and not name.startswith("DCC_LOGGER_")
         )
+    )
 
+
+@profiled
+def get_build_cache_key(options):
+    """
+    return a key identifying the result of this compilation
+    or None if the result can not safely be cached
+    """
+    if (
+        (not options.cache_directory and not options.system_cache_directory)
+        or not options.build_cache
+        or options.debug
+        or options.incremental_compilation
+        or options.object_files_being_linked
+        or options.libraries_being_linked
+        or options.untracked_dependencies
+        or not options.dependency_files
+    ):
+        return None
+    # include paths may change which files the compiler reads
+    for arg in options.user_supplied_compiler_args:
+        if arg.startswith("-I") or arg.startswith("-i"):
+            return None
+    # the contents of the files are identified by digests from the include scan
+    dependencies = sorted(options.dependency_digests.items())
+    return cache_key(
+        "build",
+        VERSION,
+        program_identity(options.dcc_path),
+        sys.platform,
+        platform.node(),
+        os.getcwd(),
+        sys.argv[1:],
+        options.cpp_mode,
+        options.colorize_output,
+        options.sanitizers,
+        options.c_compiler,
+        options.clang_version,
+        program_identity(options.c_compiler),
+        program_identity("g++" if options.cpp_mode else "gcc")
+        if options.also_run_gcc
+        else "",
+        get_build_environment(),
+        dependencies,
+    )
+
+
+@profiled
+def fetch_cached_build(build_key, options):
+    """
+    return the result of an identical previous compilation
+    after copying its executable to options.object_pathname
+    """
+    if not build_key:
+        return None
+    result_pathname = cache_lookup(options, build_key, suffix=".json")
+    if not result_pathname:
+        return None
+    try:
+        with open(result_pathname, encoding="utf-8") as f:
+            result = json.load(f)
+    except (OSError, ValueError) as e:
+        options.debug_print("fetch_cached_build", e)
+        return None
+    # output cached by a compile without structured diagnostics can not be explained
+    # as this compile's would be, so it is compiled again & its diagnostics cached
+    if options.structured_diagnostics and "diagnostics" not in result:
+        return None
+    if not cache_fetch(options, build_key, options.object_pathname, suffix=".out"):
+        return None
+    options.debug_print("using cached build of", options.object_pathname)
+    # the compiler output is replayed so warnings & explanations are unchanged
+    p = subprocess.CompletedProcess(
+        result["args"], result["returncode"], stdout=result["stdout"]
+    )
+    if options.structured_diagnostics:
+        p.diagnostics = diagnostics_from_json(result["diagnostics"])
     return p
 
 
+@profiled
+def cache_build(build_key, process, options):
+    if not build_key or not process or process.returncode != 0:
+        return
+    result = {
+        "args": process.args,
+        "returncode": process.returncode,
+        "stdout": process.stdout or "",
+    }
+    if hasattr(process, "diagnostics"):
+        result["diagnostics"] = diagnostics_to_json(process.diagnostics)
+    # executable is inserted first, so the presence of result implies an executable
+    if cache_insert(options, build_key, options.object_pathname, suffix=".out"):
+        cache_insert(
+            options,
+            build_key,
+            contents=json.dumps(result).encode("utf-8"),
+            suffix=".json",
+        )
+
+
 # customize wrapper source for a particular sanitizer
+@profiled
 def update_wrapper_source(sanitizer, sanitizer_n, src, tar_source, options):
     src = src.replace("__SANITIZER__", sanitizer.upper())
+    sanitizer_args = get_sanitizer_args(sanitizer, sanitizer_n, options)
+    if "-fsanitize=undefined" in sanitizer_args:
+        src = src.replace("__UNDEFINED_BEHAVIOUR_SANITIZER_IN_USE__", "1")
+
+    src = src.replace("__LEAK_CHECK_YES_NO__", "yes" if options.leak_check else "no")
+    leak_check = options.leak_check
+    if leak_check and options.sanitizers[1:] == ["valgrind"]:
+        # do leak checking in valgrind (only) for (currently) better messages
+        leak_check = False
+    src = src.replace("__LEAK_CHECK_1_0__", "1" if leak_check else "0")
+    src = src.replace("__USE_FUNOPEN__", "1" if options.use_funopen else "0")
+
+    src = src.replace("__I_AM_SANITIZER1__", "1" if sanitizer_n == 1 else "0")
+    src = src.replace("__I_AM_SANITIZER2__", "1" if sanitizer_n == 2 else "0")
+    src = src.replace(
+        "__WHICH_SANITIZER__", "sanitizer2" if sanitizer_n == 2 else "sanitizer1"
+    )
+
+    src = tar_source + src
+    return src, sanitizer_args
+
+
+def get_sanitizer_args(sanitizer, sanitizer_n, options, linking=True):
+    """
+    return the compiler arguments for sanitizer
+    linking is False if the compiler is only producing object files
+    """
     if sanitizer == "valgrind":
         sanitizer_args = []
     elif sanitizer == "memory":
@@ -178,8 +563,10 @@ def update_wrapper_source(sanitizer, sanitizer_n, src, tar_source, options):
     if sanitizer != "memory" and not (sanitizer_n == 2 and sanitizer == "valgrind"):
         # FIXME if we enable '-fsanitize=undefined', '-fno-sanitize-recover=undefined,integer' for memory
         # which would be preferable here we get uninitialized variable error message for undefined errors
-        src = src.replace("__UNDEFINED_BEHAVIOUR_SANITIZER_IN_USE__", "1")
-        sanitizer_args += ["-fsanitize=undefined"]
+        # workaround for  https://github.com/android-ndk/ndk/issues/184
+        # a compile without a link can not fail because of the UBSan runtime
+        if not linking or undefined_behaviour_sanitizer_links(options):
+            sanitizer_args += ["-fsanitize=undefined"]
     if sanitizer == "address":
         sanitizer_args += ["-ftrivial-auto-var-init=pattern"]
 
@@ -194,25 +581,124 @@ def update_wrapper_source(sanitizer, sanitizer_n, src, tar_source, options):
         )
         if os.path.exists(lib_dir):
             sanitizer_args += ["-shared-libasan", "-Wl,-rpath," + lib_dir]
+    return sanitizer_args
 
-    src = src.replace("__LEAK_CHECK_YES_NO__", "yes" if options.leak_check else "no")
-    leak_check = options.leak_check
-    if leak_check and options.sanitizers[1:] == ["valgrind"]:
-        # do leak checking in valgrind (only) for (currently) better messages
-        leak_check = False
-    src = src.replace("__LEAK_CHECK_1_0__", "1" if leak_check else "0")
-    src = src.replace("__USE_FUNOPEN__", "1" if options.use_funopen else "0")
 
-    src = src.replace("__I_AM_SANITIZER1__", "1" if sanitizer_n == 1 else "0")
-    src = src.replace("__I_AM_SANITIZER2__", "1" if sanitizer_n == 2 else "0")
-    src = src.replace(
-        "__WHICH_SANITIZER__", "sanitizer2" if sanitizer_n == 2 else "sanitizer1"
-    )
+def undefined_behaviour_sanitizer_links(options):
+    """
+    return False if programs compiled with -fsanitize=undefined fail to link
+    because __mulodi4 is missing, e.g. on 32-bit platforms
+    the result is saved with the toolchain probe results
+    so the test compile is only done once for each compiler
+    """
+    if options.undefined_behaviour_sanitizer_links is None:
+        compiler = options.c_compiler.replace("clang++", "clang")
+        # the test link must use the linker programs are linked with
+        linker_arguments = get_linker_arguments(options)
+        arguments = ["-fsanitize=undefined", "-x", "c", "-"] + linker_arguments
+        source = "int main(int argc, char **argv) { return (long long)argc * argc; }\n"
+
+        def test_link():
+            executable = os.path.join(options.temporary_directory, "ubsan_link_test")
+            p = run([compiler] + arguments + ["-o", executable], options, input=source)
+            return not undefined_symbol_reported(p.stdout, "__mul")
 
-    src = tar_source + src
-    return src, sanitizer_args
+        try:
+            options.undefined_behaviour_sanitizer_links = options.probe.cached_result(
+                compiler, ["link test"] + arguments + [source], test_link
+            )
+            options.probe.save(options.cache_directory)
+        except OSError as e:
+            options.debug_print("undefined_behaviour_sanitizer_links", e)
+            options.undefined_behaviour_sanitizer_links = True
+    return options.undefined_behaviour_sanitizer_links
+
+
+# linkers used instead of the default linker, in order of preference,
+# as -fuse-ld=<name> & the program which must be in $PATH
+FAST_LINKERS = [("lld", "ld.lld"), ("mold", "mold")]
+
+# GNU ld, lld & mold word a reference to an undefined symbol differently:
+#   x.c:3: undefined reference to `main'
+#   ld.lld: error: undefined symbol: main
+#   mold: error: undefined symbol: main
+UNDEFINED_SYMBOL_RE = re.compile(
+    r"(?:undefined reference to `|undefined symbol: )(\w+)"
+)
+
+# checks the linker wraps a function defined in another object file, & a libc function
+LINKER_TEST_SOURCE = """
+#include <stdio.h>
+int __real_main(void);
+int __real_fileno(FILE *stream);
+int __wrap_fileno(FILE *stream) { return __real_fileno(stream) + 40; }
+int __wrap_main(void) { return __real_main() + fileno(stdin); }
+int main(void) { return 2; }
+"""
+
+
+def get_linker_arguments(options):
+    """
+    return arguments selecting a linker faster than the default linker,
+    if one is installed and correctly links programs using -Wl,-wrap
+    the result of testing each linker is saved with the toolchain probe results
+    so the test link is only done once for each compiler & linker
+    """
+    if options.linker_arguments is not None:
+        return options.linker_arguments
+    if (
+        sys.platform != "linux"
+        or options.ifdef_instead_of_wrap
+        or "clang" not in options.c_compiler
+        or any(a.startswith("-fuse-ld=") for a in options.user_supplied_compiler_args)
+    ):
+        options.linker_arguments = []
+        return options.linker_arguments
+    # set only when the linkers have been tested,
+    # as the sanitizer builds may call this concurrently
+    linker_arguments = []
+    compiler = options.c_compiler.replace("clang++", "clang")
+    for name, program in FAST_LINKERS:
+        pathname = options.probe.search_path(program)
+        if not pathname:
+            continue
+        arguments = [f"-fuse-ld={name}", "-Wl,-wrap,main,-wrap,fileno", "-x", "c", "-"]
 
+        def test_link():
+            executable = os.path.join(options.temporary_directory, "linker_test")
+            command = [compiler] + arguments + ["-o", executable]
+            p = run(command, options, input=LINKER_TEST_SOURCE)
+            if p.returncode != 0:
+                return False
+            return run([executable], options).returncode == 42
 
+        try:
+            works = options.probe.cached_result(
+                compiler,
+                ["linker test", program_identity(pathname), LINKER_TEST_SOURCE]
+                + arguments,
+                test_link,
+            )
+            options.probe.save(options.cache_directory)
+        except OSError as e:
+            options.debug_print("get_linker_arguments", e)
+            works = False
+        if works:
+            options.debug_print("linking with", name)
+            linker_arguments = [f"-fuse-ld={name}"]
+            break
+    options.linker_arguments = linker_arguments
+    return options.linker_arguments
+
+
+def undefined_symbol_reported(output, prefix):
+    """
+    return True if the linker output reports an undefined symbol starting with prefix
+    """
+    return any(s.startswith(prefix) for s in UNDEFINED_SYMBOL_RE.findall(output))
+
+
+@profiled
 def execute_compiler(
     compiler,
     dcc_supplied_arguments,
@@ -223,7 +709,15 @@ def execute_compiler(
     wrapper_cpp_source="",
     wrapper_extra_options=[],
     debug_cpp_wrapper_file="tmp_dcc_sanitizer1.cpp",
+    embedded_data_objects=[],
+    compiled_sources=None,
 ):
+    """
+    compile & link the user's code with the wrapper code
+    embedded_data_objects are object files created by embed_data_file
+    if compiled_sources is supplied, it is the result of compile_user_sources
+    and the user's code is linked from its object files
+    """
     extra_c_arguments, extra_c_arguments_debug = compile_wrapper_source(
         wrapper_C_source,
         options,
@@ -241,12 +735,31 @@ def execute_compiler(
         wrapper_extra_options=wrapper_extra_options,
     )
 
+    user_arguments = options.user_supplied_compiler_args
+    precompiled_header_arguments = []
+    if compiled_sources:
+        compile_process, objects = compiled_sources
+        user_arguments = [objects.get(arg, arg) for arg in user_arguments]
+    else:
+        precompiled_header_arguments = get_precompiled_header_arguments(
+            compiler,
+            get_compile_arguments(
+                remove_output_arguments(dcc_supplied_arguments)
+                + [arg for arg in extra_c_arguments if arg.startswith("-D")],
+                options,
+            ),
+            options,
+        )
+
     command = (
         [compiler]
         + dcc_supplied_arguments
         + extra_c_arguments
         + extra_cpp_arguments
-        + options.user_supplied_compiler_args
+        + embedded_data_objects
+        + precompiled_header_arguments
+        + user_arguments
+        + get_linker_arguments(options)
         + options.dcc_supplied_linker_args
     )
     if options.debug > 1:
@@ -255,21 +768,41 @@ def execute_compiler(
             + dcc_supplied_arguments
             + extra_c_arguments_debug
             + extra_cpp_arguments_debug
-            + options.user_supplied_compiler_args
+            + embedded_data_objects
+            + user_arguments
+            + get_linker_arguments(options)
             + options.dcc_supplied_linker_args
         )
         append_debug_compile(debug_command)
-    p = run(command, options)
-
-    # avoid a confusing mess of linker errors
-    if "undefined reference to `main" in p.stdout:
-        p.stdout = "error: your program does not contain a main function - a C program must contain a main function"
-        p.returncode = 1
+    p = run_monitored(command, options)
+    if precompiled_header_failed(p, precompiled_header_arguments, options):
+        command = [c for c in command if c not in precompiled_header_arguments]
+        p = run_monitored(command, options)
+    if compiled_sources:
+        p.stdout = compile_process.stdout + p.stdout
+        if options.structured_diagnostics:
+            p.diagnostics = get_diagnostics([compile_process, p])
+
+    if check_for_main(p):
         return p
 
     # workaround for  https://github.com/android-ndk/ndk/issues/184
     # when not triggered earlier
-    if "undefined reference to `__mul" in p.stdout:
+    if undefined_symbol_reported(p.stdout, "__mul") and compiled_sources:
+        # object files compiled with -fsanitize=undefined are no use
+        return execute_compiler(
+            compiler,
+            dcc_supplied_arguments,
+            options,
+            rename_functions=rename_functions,
+            wrapper_C_source=wrapper_C_source,
+            debug_C_wrapper_file=debug_C_wrapper_file,
+            wrapper_cpp_source=wrapper_cpp_source,
+            wrapper_extra_options=wrapper_extra_options,
+            debug_cpp_wrapper_file=debug_cpp_wrapper_file,
+            embedded_data_objects=embedded_data_objects,
+        )
+    if undefined_symbol_reported(p.stdout, "__mul"):
         command = [
             c
             for c in command
@@ -278,12 +811,12 @@ def execute_compiler(
         ]
         options.debug_print("undefined reference to `__mulodi4'")
         options.debug_print("recompiling", " ".join(command))
-        p = run(command, options)
+        p = run_monitored(command, options)
 
     # a user call to a renamed unistd.h function appears to be undefined
     # so recompile without renames
 
-    if rename_functions and "undefined reference to `__renamed_" in p.stdout:
+    if rename_functions and undefined_symbol_reported(p.stdout, "__renamed_"):
         options.debug_print(
             "undefined reference to `__renamed_' recompiling without -D renames"
         )
@@ -296,10 +829,24 @@ def execute_compiler(
             debug_C_wrapper_file=debug_C_wrapper_file,
             wrapper_cpp_source=wrapper_cpp_source,
             debug_cpp_wrapper_file=debug_cpp_wrapper_file,
+            embedded_data_objects=embedded_data_objects,
         )
     return p
 
 
+def check_for_main(p):
+    """
+    avoid a confusing mess of linker errors, return True if main is missing
+    """
+    if "main" not in UNDEFINED_SYMBOL_RE.findall(p.stdout):
+        return False
+    p.stdout = "error: your program does not contain a main function - a C program must contain a main function"
+    p.diagnostics = []
+    p.returncode = 1
+    return True
+
+
+@profiled
 def compile_wrapper_source(
     source,
     options,
@@ -311,9 +858,9 @@ def compile_wrapper_source(
     if not source:
         return [], []
     rename_arguments, source = get_rename_arguments(source, options, rename_functions)
-    relocatable_basename = (
-        "dcc_cpp_wrapper_source.o" if cpp else "dcc_c_wrapper_source.o"
-    )
+    # wrapper code for the two sanitizers may be compiled concurrently
+    # so object file name must be unique
+    relocatable_basename = debug_wrapper_file + ".o"
     relocatable_pathname = os.path.join(
         options.temporary_directory, relocatable_basename
     )
@@ -335,6 +882,7 @@ def compile_wrapper_source(
             relocatable_basename,
         ] + WRAPPER_SOURCE_COMPILER_ARGS
         append_debug_compile(debug_command)
+    compiler_args = WRAPPER_SOURCE_COMPILER_ARGS + wrapper_extra_options
     command = [
         compiler,
         "-c",
@@ -343,16 +891,304 @@ def compile_wrapper_source(
         "-",
         "-o",
         relocatable_pathname,
-    ] + WRAPPER_SOURCE_COMPILER_ARGS + wrapper_extra_options
+    ] + compiler_args
     options.debug_print("wrapper options", wrapper_extra_options)
-    process = run(command, options, input=source)
-    if process.stdout or process.returncode != 0:
-        options.die("Internal error\n" + process.stdout)
+    # the object file depends only on the compiler, its arguments & the wrapper source
+    # so it can be reused by later dcc invocations
+    key = cache_key(
+        "wrapper", VERSION, program_identity(compiler), cpp, compiler_args, source
+    )
+    if not cache_fetch(options, key, relocatable_pathname, suffix=".o"):
+        process = run(command, options, input=source)
+        if process.stdout or process.returncode != 0:
+            options.die("Internal error\n" + process.stdout)
+        cache_insert(options, key, relocatable_pathname, suffix=".o")
     return rename_arguments + [relocatable_pathname], rename_arguments + [
         relocatable_basename
     ]
 
 
+@profiled
+def compile_user_sources(compiler, dcc_supplied_arguments, options, object_prefix):
+    """
+    compile each of the user's source files to an object file
+    return process with the combined compiler output
+    and a dict mapping source pathnames to object pathnames
+    """
+    sources = get_user_sources(options)
+    rename_arguments, _ = get_rename_arguments("", options)
+    arguments = get_compile_arguments(
+        dcc_supplied_arguments + rename_arguments, options
+    )
+    precompiled_header_arguments = get_precompiled_header_arguments(
+        compiler, arguments, options
+    )
+    headers = get_object_cache_headers(sources, options)
+    commands = []
+    for i, source in enumerate(sources):
+        object_pathname = os.path.join(
+            options.temporary_directory,
+            f"{object_prefix}_{i}_{os.path.basename(source)}.o",
+        )
+        command = [compiler] + arguments + ["-c", source, "-o", object_pathname]
+        if options.debug > 1:
+            append_debug_compile(command)
+        commands.append(command)
+
+    def compile_source(command):
+        source, object_pathname = command[-3], command[-1]
+        key = get_object_cache_key(command[:-1], source, headers, options)
+        p = fetch_cached_object(key, command, options)
+        if p:
+            return p
+        # only the first file's output is watched for errors
+        # as errors in later files would be shown after its output
+        watch = command is commands[0]
+        p = run_monitored(command + precompiled_header_arguments, options, watch)
+        if precompiled_header_failed(p, precompiled_header_arguments, options):
+            p = run_monitored(command, options, watch)
+        cache_object(key, p, object_pathname, options)
+        return p
+
+    # the files are compiled concurrently, one compiler process per file
+    with concurrent.futures.ThreadPoolExecutor(get_n_cpus()) as executor:
+        results = list(executor.map(compile_source, commands))
+    returncode = next((p.returncode for p in results if p.returncode), 0)
+    objects = {command[-3]: command[-1] for command in commands}
+    # diagnostics are in the same order as a single compiler invocation would produce
+    process = subprocess.CompletedProcess(
+        [compiler] + arguments + sources,
+        returncode,
+        stdout="".join(p.stdout for p in results),
+    )
+    if options.structured_diagnostics:
+        process.diagnostics = get_diagnostics(results)
+    return process, objects
+
+
+def get_n_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # os.sched_getaffinity is not available on macOS
+        return os.cpu_count() or 1
+
+
+def get_object_cache_headers(sources, options):
+    """
+    return the pathnames & digests of the contents of the files, other than sources,
+    which the user's source files include
+    or None if the object files can not safely be cached
+    """
+    if (
+        not options.cache_directory
+        or options.untracked_dependencies
+        or not set(sources) <= options.dependency_files
+    ):
+        return None
+    # include paths may change which files the compiler reads
+    for arg in options.user_supplied_compiler_args:
+        if arg.startswith("-I") or arg.startswith("-i"):
+            return None
+    return [
+        (pathname, digest)
+        for (pathname, digest) in sorted(options.dependency_digests.items())
+        if pathname not in sources or pathname in options.included_files
+    ]
+
+
+def get_object_cache_key(command, source, headers, options):
+    """
+    return a key identifying the object file produced by compiling source
+    with command, which excludes the object file's pathname
+    headers is the result of get_object_cache_headers
+    """
+    if headers is None:
+        return None
+    return cache_key(
+        "object",
+        VERSION,
+        program_identity(command[0]),
+        sys.platform,
+        os.getcwd(),
+        command,
+        get_build_environment(),
+        options.dependency_digests[source],
+        headers,
+    )
+
+
+@profiled
+def fetch_cached_object(key, command, options):
+    """
+    copy a cached object file to command's output file
+    return a process with the compiler output produced when it was compiled,
+    and its diagnostics if they were cached, None if it is not cached
+    """
+    if not key:
+        return None
+    result_pathname = cache_lookup(options, key, suffix=".json")
+    if not result_pathname:
+        return None
+    try:
+        with open(result_pathname, encoding="utf-8") as f:
+            result = json.load(f)
+    except (OSError, ValueError) as e:
+        options.debug_print("fetch_cached_object", e)
+        return None
+    # output cached by a compile without structured diagnostics can not be explained
+    # as this compile's would be, so it is compiled again & its diagnostics cached
+    if options.structured_diagnostics and "diagnostics" not in result:
+        return None
+    object_pathname = command[-1]
+    if not cache_fetch(options, key, object_pathname, suffix=".o"):
+        return None
+    options.debug_print("using cached object file", object_pathname)
+    p = subprocess.CompletedProcess(command, 0, stdout=result["stdout"])
+    if options.structured_diagnostics:
+        p.diagnostics = diagnostics_from_json(result["diagnostics"])
+    return p
+
+
+def cache_object(key, process, object_pathname, options):
+    if not key or process.returncode != 0:
+        return
+    result = {"stdout": process.stdout or ""}
+    if hasattr(process, "diagnostics"):
+        result["diagnostics"] = diagnostics_to_json(process.diagnostics)
+    # object file is inserted first, so the presence of result implies an object file
+    if cache_insert(options, key, object_pathname, suffix=".o"):
+        cache_insert(
+            options, key, contents=json.dumps(result).encode("utf-8"), suffix=".json"
+        )
+
+
+def get_compile_arguments(dcc_supplied_arguments, options):
+    """
+    return the arguments to compile, but not link, the user's source files
+    excluding the source files themselves
+    """
+    sources = get_user_sources(options)
+    # linker arguments would produce unused argument warnings
+    return [
+        arg
+        for arg in dcc_supplied_arguments + options.user_supplied_compiler_args
+        if arg not in sources
+        and not arg.startswith("-Wl,")
+        and not arg.startswith("-l")
+        and not arg.startswith("-fuse-ld=")
+    ]
+
+
+def remove_output_arguments(arguments):
+    """
+    return arguments without any -o <pathname>
+    """
+    remaining_arguments = []
+    arguments = list(arguments)
+    while arguments:
+        arg = arguments.pop(0)
+        if arg == "-o" and arguments:
+            arguments.pop(0)
+        else:
+            remaining_arguments.append(arg)
+    return remaining_arguments
+
+
+@profiled
+def get_precompiled_header_arguments(compiler, arguments, options):
+    """
+    return arguments to include a precompiled header
+    containing the system headers included by the user's program
+    arguments are those used to compile the user's program, which the header must match
+
+    an empty list is returned if a precompiled header can not safely be used
+    the precompiled header is kept in the cache, next to the header it was built from
+    because clang checks that header is unchanged when the precompiled header is used
+    """
+    includes = sorted(options.system_includes_used)
+    if (
+        "clang" not in compiler
+        or not options.cache_directory
+        or not includes
+        or not options.system_includes_used
+        <= options.dual_sanitizer_safe_system_includes
+        or options.directives_before_system_includes
+        # the header must contain only the headers each source file includes
+        # or it could declare names which clash with the user's code
+        or len(get_user_sources(options)) != 1
+    ):
+        return []
+    language = "c++-header" if options.cpp_mode else "c-header"
+    key = cache_key(
+        "precompiled header",
+        VERSION,
+        program_identity(compiler),
+        language,
+        arguments,
+        includes,
+    )
+    header = cache_lookup(options, key, suffix=".h")
+    if not header:
+        header_source = "".join(f"#include <{include}>\n" for include in includes)
+        cache_insert(options, key, contents=header_source.encode(), suffix=".h")
+        header = cache_lookup(options, key, suffix=".h")
+        if not header:
+            return []
+    precompiled_header = cache_lookup(options, key, suffix=".pch")
+    if not precompiled_header:
+        pathname = os.path.join(options.temporary_directory, key + ".pch")
+        command = [compiler, "-x", language, header, "-o", pathname] + arguments
+        p = run(command, options)
+        if p.returncode != 0:
+            options.debug_print("precompiled header build failed", p.stdout)
+            return []
+        cache_insert(options, key, pathname, suffix=".pch")
+        precompiled_header = cache_lookup(options, key, suffix=".pch")
+        if not precompiled_header:
+            return []
+    return ["-include-pch", precompiled_header]
+
+
+def precompiled_header_failed(p, precompiled_header_arguments, options):
+    """
+    return True if the compiler rejected the precompiled header
+    e.g. because a system header has changed since it was built
+    the precompiled header is removed from the cache so it will be rebuilt
+    """
+    if not precompiled_header_arguments:
+        return False
+    if not any(error in p.stdout for error in PRECOMPILED_HEADER_ERRORS):
+        return False
+    pathname = precompiled_header_arguments[1]
+    options.debug_print("precompiled header rejected", pathname)
+    if options.cache_directory and pathname.startswith(options.cache_directory):
+        try:
+            os.unlink(pathname)
+        except OSError:
+            pass
+    return True
+
+
+def get_user_sources(options):
+    """
+    return the user's source files
+    or an empty list if the compiler arguments can not safely be split
+    into separate compile & link steps
+    """
+    sources = []
+    for arg in options.user_supplied_compiler_args:
+        if arg in ["-E", "-S", "-M", "-MM", "-fsyntax-only"]:
+            return []
+        if arg.startswith("-"):
+            continue
+        if os.path.splitext(arg)[1] not in SOURCE_FILE_SUFFIXES:
+            # e.g. an argument to a preceding option
+            return []
+        sources.append(arg)
+    return sources
+
+
 def get_rename_arguments(source, options, rename_functions=True):
     rename_arguments = []
 
@@ -371,6 +1207,9 @@ def get_rename_arguments(source, options, rename_functions=True):
                 "unlink",
                 "write",
             ]
+        rename_function_names = [
+            f for f in rename_function_names if user_may_define(f, options)
+        ]
         rename_arguments += [f"-D{f}=__renamed_{f}" for f in rename_function_names]
 
     override_functions = []
@@ -409,6 +1248,74 @@ def get_rename_arguments(source, options, rename_functions=True):
     return rename_arguments, source
 
 
+def user_may_define(name, options):
+    """
+    return False if the user's code can not define name,
+    e.g. because it only calls or declares a function of that name
+    renaming a function which the user's code calls but doesn't define
+    produces an undefined reference to `__renamed_...'
+    """
+    if options.user_source_text is None:
+        options.user_source_text = read_user_source(options)
+    source = options.user_source_text
+    if source is False:
+        return True
+    if name not in options.user_definitions:
+        options.user_definitions[name] = any(
+            not is_call_or_declaration(source, m.end())
+            for m in re.finditer(r"\b" + re.escape(name) + r"\b", source)
+        )
+    return options.user_definitions[name]
+
+
+def read_user_source(options):
+    """
+    return the user's source files & the files they include,
+    with comments & strings removed, False if they can't all be read
+    """
+    sources = get_user_sources(options)
+    if (
+        options.untracked_dependencies
+        or options.object_files_being_linked
+        or not sources
+        or not set(sources) <= options.dependency_files
+    ):
+        return False
+    text = []
+    for pathname in sorted(options.dependency_files):
+        try:
+            with open(pathname, encoding="utf-8", errors="replace") as f:
+                text.append(f.read())
+        except OSError:
+            return False
+    return COMMENT_OR_STRING_RE.sub(" ", "\n".join(text))
+
+
+COMMENT_OR_STRING_RE = re.compile(
+    r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL
+)
+
+
+def is_call_or_declaration(source, index):
+    """
+    return True if the identifier ending at index in source is followed
+    by a parenthesized argument list which is not followed by a function body
+    """
+    m = re.compile(r"\s*\(").match(source, index)
+    if not m:
+        return False
+    depth = 0
+    for i in range(m.end() - 1, len(source)):
+        if source[i] == "(":
+            depth += 1
+        elif source[i] == ")":
+            depth -= 1
+            if depth == 0:
+                # a function body, or old-style parameter declarations, follow
+                return not re.compile(r"\s*[{\w]").match(source, i + 1)
+    return False
+
+
 def append_debug_compile(command):
     try:
         with open(DEBUG_COMPILE_FILE, "a", encoding="utf-8") as f:
@@ -427,6 +1334,7 @@ def get_wrapper_cpp_code(options):
     return add_constants_to_source_code(wrapper_source, options)
 
 
+@profiled
 def get_wrapper_code(options):
     wrapper_source = "".join(
         pkgutil.get_data("embedded_src", f).decode("utf8")
@@ -439,9 +1347,11 @@ def get_wrapper_code(options):
         ]
     )
     wrapper_source = add_constants_to_source_code(wrapper_source, options)
-    wrapper_source, tar_source = add_embedded_tarfile_handling_to_source_code(
-        wrapper_source, options
-    )
+    (
+        wrapper_source,
+        tar_source,
+        tar_objects,
+    ) = add_embedded_tarfile_handling_to_source_code(wrapper_source, options)
     wrapper_cpp_source = ""
     if options.cpp_mode:
         wrapper_cpp_source = "".join(
@@ -450,7 +1360,7 @@ def get_wrapper_code(options):
                 "dcc_io.cpp",
             ]
         )
-    return wrapper_source, tar_source, wrapper_cpp_source
+    return wrapper_source, tar_source, tar_objects, wrapper_cpp_source
 
 
 def add_constants_to_source_code(src, options):
@@ -481,19 +1391,22 @@ def add_constants_to_source_code(src, options):
 
 
 def add_embedded_tarfile_handling_to_source_code(src, options):
-    tar_n_bytes, tar_source = source_for_embedded_tarfile(options)
-    watcher = rf"PATH=$PATH:/bin:/usr/bin:/usr/local/bin exec python3 -E -c \"import io,os,sys,tarfile,tempfile\n\
+    tar_source, tar_objects = source_for_embedded_tarfile(options)
+    # the archive size is passed in the environment so the wrapper source
+    # does not depend on the user's program
+    watcher = r"PATH=$PATH:/bin:/usr/bin:/usr/local/bin exec python3 -E -c \"import io,os,sys,tarfile,tempfile\n\
 with tempfile.TemporaryDirectory() as temp_dir:\n\
- buffer = io.BytesIO(sys.stdin.buffer.raw.read({tar_n_bytes}))\n\
- if len(buffer.getbuffer()) == {tar_n_bytes}:\n\
-  k = {{'filter':'data'}} if hasattr(tarfile, 'data_filter') else {{}}\n\
-  tarfile.open(fileobj=buffer, bufsize={tar_n_bytes}, mode='r|xz').extractall(temp_dir, **k)\n\
+ n = int(os.environ['DCC_TAR_N_BYTES'])\n\
+ buffer = io.BytesIO(sys.stdin.buffer.raw.read(n))\n\
+ if len(buffer.getbuffer()) == n:\n\
+  k = {'filter':'data'} if hasattr(tarfile, 'data_filter') else {}\n\
+  tarfile.open(fileobj=buffer, mode='r:xz', ignore_zeros=True).extractall(temp_dir, **k)\n\
   os.environ['DCC_PWD'] = os.getcwd()\n\
   os.chdir(temp_dir)\n\
   exec(open('watch_valgrind.py').read())\n\
 \""
     src = src.replace("__MONITOR_VALGRIND__", watcher)
-    return src, tar_source
+    return src, tar_source, tar_objects
 
 
 def embeded_environment_variables(options):
@@ -519,60 +1432,392 @@ def run(
     check=False,
 ):
     options.debug_print(" ".join(command))
-    return subprocess.run(
+    before = start_subprocess_record()
+    # like subprocess.run, but the process's resource use can be recorded
+    with profiled_popen(
+        command,
+        stdin=subprocess.PIPE if input is not None else None,
+        stdout=stdout,
+        stderr=stderr,
+        text=text,
+        errors=errors,
+    ) as process:
+        try:
+            stdout, stderr = process.communicate(input)
+        except BaseException:
+            process.kill()
+            raise
+    record_subprocess(command, process.returncode, before, process)
+    p = subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+    if check:
+        p.check_returncode()
+    return p
+
+
+def run_monitored(command, options, watch=True):
+    """
+    run a compile of the user's code, like run,
+    reading the compiler output as it is produced
+    so the compile can be stopped as soon as options.error_monitor sees an error
+    if watch is False, the output is not checked for errors
+
+    if options.structured_diagnostics is set, the process returned has an attribute
+    diagnostics, a list of the compiler's diagnostics, see serialized_diagnostics.py
+    """
+    diagnostics_pathname = get_diagnostics_pathname(command, options)
+    if diagnostics_pathname:
+        command = command + ["--serialize-diagnostics", diagnostics_pathname]
+    if options.error_monitor:
+        # the diagnostics file is only complete if the compiler finishes
+        p = run_watched(command, options, watch, stop_early=not diagnostics_pathname)
+    else:
+        p = run(command, options)
+    if diagnostics_pathname:
+        diagnostics = read_serialized_diagnostics(diagnostics_pathname, options.debug)
+        p.diagnostics = diagnostics or []
+    return p
+
+
+def get_diagnostics_pathname(command, options):
+    """
+    return a pathname for clang to write structured diagnostics for command
+    or None if they are not wanted
+    """
+    if (
+        not options.structured_diagnostics
+        or not options.explanations
+        or "clang" not in os.path.basename(command[0])
+        or not options.temporary_directory
+    ):
+        return None
+    fd, pathname = tempfile.mkstemp(suffix=".dia", dir=options.temporary_directory)
+    os.close(fd)
+    return pathname
+
+
+def get_diagnostics(processes):
+    """
+    return the structured diagnostics of processes, in order
+    """
+    return [d for p in processes for d in getattr(p, "diagnostics", [])]
+
+
+def run_watched(command, options, watch=True, stop_early=True):
+    """
+    run command, watching its output for errors, see run_monitored
+    if stop_early is False, command is not stopped when it outputs an error
+    but other compiles are when it finishes
+    """
+    monitor = options.error_monitor
+    process = monitor.start(command, options)
+    if not process:
+        options.debug_print("not running, error already seen:", " ".join(command))
+        return subprocess.CompletedProcess(command, 1, stdout="")
+    watcher = ErrorWatcher() if watch else None
+    # gcc outputs nothing after an error message until it finishes
+    quiet_stop = "clang" not in os.path.basename(command[0])
+    decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(
+        errors="replace"
+    )
+    fd = process.stdout.fileno()
+    output = []
+    error_seen = False
+    try:
+        while True:
+            if (
+                stop_early
+                and quiet_stop
+                and watcher
+                and watcher.error_may_be_complete()
+                and not select.select([fd], [], [], ERROR_MESSAGE_QUIET_SECONDS)[0]
+            ):
+                error_seen = True
+            else:
+                data = os.read(fd, 65536)
+                text = decoder.decode(data, final=not data)
+                output.append(text)
+                if watcher and watcher.add_output(text):
+                    error_seen = True
+                if not data:
+                    break
+            if error_seen and stop_early:
+                process.kill()
+                break
+        # closing the pipe also stops any subprocesses the compiler has started
+        process.stdout.close()
+        process.wait()
+    finally:
+        monitor.finish(process)
+    options.debug_print(process.args[0], "exit status", process.returncode, level=2)
+    record_subprocess(process.args, process.returncode, process.profile_record, process)
+    p = subprocess.CompletedProcess(command, process.returncode, "".join(output))
+    if error_seen or (watcher and watcher.in_error and p.returncode != 0):
+        options.debug_print("compiler output an error, stopping compiles")
+        p.returncode = 1
+        monitor.stop(p)
+    return p
+
+
+class ErrorMonitor:
+    """
+    keeps track of the compiles of the user's code running for one dcc invocation
+    so they can all be stopped when one of them outputs an error
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.failed_process = None
+
+    def start(self, command, options):
+        """
+        start command, return None if an error has already been seen
+        """
+        with self.lock:
+            if self.failed_process:
+                return None
+            process = start(command, options, text=False, errors=None)
+            self.processes.add(process)
+            return process
+
+    def finish(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+    def stop(self, failed_process):
+        """
+        record the compile which output an error and kill the other compiles
+        """
+        with self.lock:
+            if not self.failed_process:
+                self.failed_process = failed_process
+            for process in self.processes:
+                process.kill()
+
+
+class ErrorWatcher:
+    """
+    recognizes a complete error message in compiler output, as it is produced
+    the message is complete when the line after it has been seen
+    as messages are parsed by explain_compiler_output.parse_compiler_output
+    """
+
+    def __init__(self):
+        self.in_error = False
+        self.caret_seen = False
+        self.partial_line = ""
+
+    def add_output(self, text):
+        """
+        return True if text completes an error message
+        """
+        lines = (self.partial_line + text).split("\n")
+        self.partial_line = lines.pop()
+        return any(self.add_line(line) for line in lines)
+
+    def add_line(self, line):
+        """
+        return True if line completes an error message
+        """
+        line = colors.strip_color(line)
+        is_message = re.match(r"^\S.*:\d+:", line)
+        if self.in_error:
+            if re.match(r"^[ ~\d|]*\^[ ~]*$", line):
+                self.caret_seen = True
+            is_note = re.match(r"^\S.*?:\d+:\d+:\s*note:", line)
+            return bool(
+                not line or line.endswith(" generated.") or is_message and not is_note
+            )
+        if is_message:
+            m = re.match(r"^\S.*?:\d+:\d+:\s*(.*?):", line)
+            self.in_error = bool(
+                m
+                and m.group(1) in ["error", "fatal error"]
+                and not any(error in line for error in PRECOMPILED_HEADER_ERRORS)
+            )
+        return False
+
+    def error_may_be_complete(self):
+        """
+        return True if the output so far ends with an error message
+        whose caret line has been seen
+        """
+        return self.in_error and self.caret_seen and not self.partial_line
+
+
+def start(
+    command,
+    options,
+    stdout=subprocess.PIPE,
+    stderr=subprocess.STDOUT,
+    text=True,
+    errors="replace",
+):
+    """
+    start command running in the background, pass the return value to finish
+    """
+    options.debug_print(" ".join(command))
+    process = profiled_popen(
         command,
-        input=input,
+        stdin=subprocess.DEVNULL,
         stdout=stdout,
         stderr=stderr,
         text=text,
         errors=errors,
-        check=check,
     )
+    process.profile_record = start_subprocess_record()
+    return process
 
 
-def source_for_sanitizer2_executable(executable):
-    source = "\nstatic uint64_t sanitizer2_executable[] = {"
-    source += bytes2hex64_initializers(executable)
-    source += "};\n"
-    n_bytes = len(executable)
-    return n_bytes, source
+def finish(process, options, kill=False):
+    """
+    wait for a process started by start, return a subprocess.CompletedProcess
+    if kill is set, the process is killed first
+    """
+    if kill:
+        process.kill()
+    stdout, stderr = process.communicate()
+    options.debug_print(process.args[0], "exit status", process.returncode, level=2)
+    record_subprocess(process.args, process.returncode, process.profile_record, process)
+    return subprocess.CompletedProcess(
+        process.args, process.returncode, stdout=stdout, stderr=stderr
+    )
 
 
+@profiled
 def source_for_embedded_tarfile(options):
-    for file in FILES_EMBEDDED_IN_BINARY:
-        contents = pkgutil.get_data("embedded_src", file)
-        if file.endswith(".py"):
-            contents = minify(contents, options)
-        add_tar_file(options.tar, file, contents)
-    options.tar.close()
-    n_bytes = options.tar_buffer.tell()
-    options.tar_buffer.seek(0)
-
-    source = "\nstatic uint64_t tar_data[] = {"
-    while True:
-        bytes_read = options.tar_buffer.read(1024)
-        if not bytes_read:
-            break
-        source += bytes2hex64_initializers(bytes_read) + ",\n"
-    source += "};\n"
-    return n_bytes, source
+    """
+    return C source & object files for the data embedded in the binary
+    it contains two concatenated xz-compressed tar archives
+    the first contains dcc's run-time Python, the second the user's source files
+    """
+    runtime_source, runtime_objects = embed_data(
+        "runtime_tar_data", get_runtime_tarfile(options), options
+    )
+    tar_source, tar_objects = embed_data(
+        "tar_data", create_source_tarfile(options), options
+    )
+    return runtime_source + tar_source, runtime_objects + tar_objects
+
+
+def create_source_tarfile(options):
+    """
+    return an xz-compressed tar archive of the user's source files
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w|xz", dereference=True) as tar:
+        for pathname in sorted(options.source_files):
+            try:
+                tar.add(pathname)
+                options.debug_print("adding", pathname, "to tar file", level=2)
+            except OSError as e:
+                options.debug_print("create_source_tarfile", pathname, e)
+    return buffer.getvalue()
+
+
+def get_runtime_tarfile(options):
+    """
+    return the archive of dcc's run-time Python
+    this is precomputed by the Makefile, but is created here if it is not available
+    or if debugging, because debugging changes how the Python is minified
+    """
+    if not options.debug:
+        try:
+            return pkgutil.get_data("embedded_src", RUNTIME_TARFILE)
+        except OSError:
+            pass
+    options.debug_print("creating run-time archive")
+    return create_runtime_tarfile(options.debug)
+
+
+def create_runtime_tarfile(debug=0):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w|xz") as tar:
+        for file in FILES_EMBEDDED_IN_BINARY:
+            contents = pkgutil.get_data("embedded_src", file)
+            if file.endswith(".py"):
+                contents = minify(contents, debug)
+            add_tar_file(tar, file, contents)
+    return buffer.getvalue()
+
+
+def write_runtime_tarfile(pathname):
+    """
+    called from the Makefile to precompute the archive of dcc's run-time Python
+    """
+    with open(pathname, "wb") as f:
+        f.write(create_runtime_tarfile())
+
+
+def embed_data(name, data, options):
+    """
+    return C source & object files making the bytes data available to the wrapper code
+    """
+    if not can_use_incbin(options):
+        return embedded_data_source(name, data), []
+    pathname = os.path.join(options.temporary_directory, name)
+    with open(pathname, "wb") as f:
+        f.write(data)
+    return embed_data_file(name, pathname, options)
+
+
+@profiled
+def embed_data_file(name, pathname, options):
+    """
+    return C source & object files making the contents of pathname
+    available to the wrapper code as uint64_t name[] and name_n_bytes
+
+    where possible the assembler includes the file's bytes directly,
+    otherwise they are converted to a C initializer which the compiler must parse
+    """
+    if not can_use_incbin(options):
+        with open(pathname, "rb") as f:
+            return embedded_data_source(name, f.read()), []
+    object_pathname = pathname + ".o"
+    assembler = EMBEDDED_DATA_ASSEMBLER.format(
+        name=name, pathname=pathname.replace("\\", "\\\\").replace('"', '\\"')
+    )
+    command = [options.c_compiler, "-c", "-x", "assembler", "-", "-o", object_pathname]
+    process = run(command, options, input=assembler)
+    if process.stdout or process.returncode != 0:
+        options.die("Internal error\n" + process.stdout)
+    # the symbols have a prefix to avoid clashing with the user's code
+    source = (
+        f'\nextern const uint64_t {name}[] __asm__("__dcc_{name}");\n'
+        + f'extern const uint64_t {name}_n_bytes __asm__("__dcc_{name}_n_bytes");\n'
+    )
+    return source, [object_pathname]
+
+
+def can_use_incbin(options):
+    """
+    the assembler directives in EMBEDDED_DATA_ASSEMBLER are ELF-specific
+    and the files left for debugging must be self-contained
+    """
+    return sys.platform.startswith("linux") and options.debug < 2
+
+
+def embedded_data_source(name, data):
+    return (
+        f"\nstatic uint64_t {name}[] = {{"
+        + bytes2hex64_initializers(data)
+        + "};\n"
+        + f"static const uint64_t {name}_n_bytes = {len(data)};\n"
+    )
 
 
 def bytes2hex64_initializers(b):
     chunk = 8
     n_bytes = len(b)
     if n_bytes % chunk:
-        b += bytes([0] * (chunk - n_bytes % chunk))
-    hex_int64 = [
-        hex(int.from_bytes(b[i : i + chunk], sys.byteorder))
-        for i in range(0, len(b), chunk)
-    ]
-    return ",".join(hex_int64)
+        b += bytes(chunk - n_bytes % chunk)
+    # native byte order, as the array is read by the machine compiled for
+    return ",".join(map(hex, memoryview(b).cast("Q")))
 
 
 # Do some brittle shrinking of Python source  before embedding in binary.
 # Very limited benefits as source is xz compressed before embedded in binary
-def minify(python_source_bytes, options):
+def minify(python_source_bytes, debug=0):
     python_source = python_source_bytes.decode("utf-8")
     lines = python_source.splitlines()
     lines1 = []
@@ -585,7 +1830,7 @@ def minify(python_source_bytes, options):
             line = lines.pop(0)
         if is_comment(line):
             continue
-        if not options.debug:
+        if not debug:
             line = re.sub(r"^(\s*)debug_print.*", r"\1pass", line)
         # removing white-space is probably safe but with xz it get us nothing
         # if line.startswith('\t') and '"' not in line and "'" not in line:
@@ -613,6 +1858,7 @@ def add_tar_file(tar, pathname, contents):
 MAX_BYTES_LOG_SOURCE_FILE = 20480
 
 
+@profiled
 def run_compile_time_logger(process, explanation_labels, options):
     """
     run a script to log compiles
@@ -627,6 +1873,8 @@ def run_compile_time_logger(process, explanation_labels, options):
         "first_line": stdout_first_line,
         "labels": explanation_labels,
     }
+    if options.profile_phases:
+        logger_info["profile"] = profile_results()
     source_file = stdout_first_line.split(":")[0]
     try:
         if (
@@ -650,7 +1898,9 @@ def run_compile_time_logger(process, explanation_labels, options):
     try:
         sys.stdout.flush()
         sys.stderr.flush()
-        subprocess.run([options.compile_logger])
+        # the logger's output goes to stderr so it can't be mixed
+        # with what is written to stdout, e.g. the results of dcc --batch
+        subprocess.run([options.compile_logger], stdout=sys.__stderr__.fileno())
     except OSError as e:
         if options.debug:
             print(e)
@@ -1,27 +1,49 @@
 #!/usr/bin/env python3
 
-import copy, math, re, sys
+import math, re, sys
 import colors
 from util import explanation_url
 
 BACKSLASH = "\\"
 
 
+# keywords shorter than this are not worth checking for
+MIN_KEYWORD_LENGTH = 3
+
+
 def get_explanation(message, colorize_output):
+    text = "\n".join(message.text_without_ansi_codes)
+    lower_case_text = text.lower()
     for e in explanations:
-        text = e.get(message, colorize_output)
-        if text:
-            e = copy.deepcopy(e)
-            e.text = text
-            return e
+        # skip explanations whose regex can not match without a regex search
+        if e.keyword not in lower_case_text:
+            continue
+        explanation_text = e.get(message, colorize_output, text)
+        if explanation_text:
+            return ExplanationResult(e, explanation_text)
     return None
 
 
+class ExplanationResult:
+    """
+    the explanation of one compiler message
+    """
+
+    def __init__(self, explanation, text):
+        self.label = explanation.label
+        self.text = text
+        self.show_note = explanation.show_note
+        self.no_following_explanations = explanation.no_following_explanations
+
+
 #
 # label - unique identifier, used as file name
 #
 # regex - if set, matched against text, if match fails no explanation is returned
 #
+# flag - if set, the warning option of the message, e.g. "-Wunused-variable",
+#        must be this or no explanation is returned
+#
 # precondition - if callable, it is called with message and regex match results as arguments
 #                if value returned is False, no explanation is returned
 #                if value returned is non-empty string and explanation is not set
@@ -54,32 +76,41 @@ class Explanation:
         reproduce="",
         long_explanation=False,
         long_explanation_url="",
+        flag="",
     ):
         self.label = label if label else re.sub(r"\W+", "_", regex).strip("_")
         self.precondition = precondition
         self.regex = regex
+        self.compiled_regex = re.compile(regex, re.I | re.DOTALL) if regex else None
+        # a lower-case string which must be in any message regex matches
+        self.keyword = required_literal(regex) if regex else ""
+        if len(self.keyword) < MIN_KEYWORD_LENGTH:
+            self.keyword = ""
         self.explanation = explanation
         self.no_following_explanations = no_following_explanations
         self.show_note = show_note
         self.reproduce = reproduce
         self.long_explanation = long_explanation
         self.long_explanation_url = long_explanation_url
+        self.flag = flag
+        # compiled explanation f-string, see render_template
+        self.template = None
 
-    def get(self, message, colorize_output):
-        explanation = self.get_short_explanation(message, colorize_output)
+    def get(self, message, colorize_output, text=None):
+        explanation = self.get_short_explanation(message, colorize_output, text)
         if explanation and (self.long_explanation or self.long_explanation_url):
             url = self.long_explanation_url or explanation_url(self.label)
             explanation += "\n  See more information here: " + url
         return explanation
 
-    def get_short_explanation(self, message, colorize_output):
+    def get_short_explanation(self, message, colorize_output, text=None):
+        if self.flag and message.flag != self.flag:
+            return None
         match = None
-        if self.regex:
-            match = re.search(
-                self.regex,
-                "\n".join(message.text_without_ansi_codes),
-                flags=re.I | re.DOTALL,
-            )
+        if self.compiled_regex:
+            if text is None:
+                text = "\n".join(message.text_without_ansi_codes)
+            match = self.compiled_regex.search(text)
             if not match:
                 return None
 
@@ -93,45 +124,183 @@ class Explanation:
         if hasattr(self.explanation, "__call__"):
             return self.explanation(message, match)
 
-        if colorize_output:
-            color = colors.color
-        else:
-            color = lambda text, *args, **kwargs: text
+        return self.render_template(message, match, colorize_output)
 
+    def render_template(self, message, match, colorize_output):
+        """
+        evaluate explanation as an f-string
+        it is translated & compiled on first use, and the result kept
+        """
+        if self.template is None:
+            self.template = compile_template(self.explanation, self.label)
+        code, names = self.template
         parameters = dict(
-            (name, getattr(message, name))
-            for name in dir(message)
-            if not name.startswith("__")
+            (name, getattr(message, name)) for name in names if hasattr(message, name)
         )
+        parameters.update(TEMPLATE_HELPERS[bool(colorize_output)])
         parameters["match"] = match
-        parameters["color"] = color
-        parameters["emphasize"] = lambda text: color(text, style="bold")
-        parameters["danger"] = lambda text: color(text, "red", style="bold")
-        parameters["info"] = lambda text: color(text, "cyan", style="bold")
+        return eval(code, globals(), parameters)
+
+
+def compile_template(f_string, label):
+    """
+    return a code object evaluating f_string, with **...** marking emphasized text,
+    and the names it uses which may be fields of a message
+    """
+    f_string = re.sub(r"\*\*\{(.*?)\}\*\*", r"{emphasize(\1)}", f_string)
+    f_string = re.sub(r"\*\*(.*?)\*\*", r"{emphasize('\1')}", f_string)
+    code = compile('f"""' + f_string + '"""', f"<explanation {label}>", "eval")
+    names = set()
+    code_objects = [code]
+    while code_objects:
+        c = code_objects.pop()
+        names.update(n for n in c.co_names + c.co_varnames if not n.startswith("__"))
+        code_objects.extend(k for k in c.co_consts if hasattr(k, "co_names"))
+    return code, sorted(names)
+
+
+def get_template_helpers(colorize_output):
+    if colorize_output:
+        color = colors.color
+    else:
+        color = lambda text, *args, **kwargs: text
+    return {
+        "color": color,
+        "emphasize": lambda text: color(text, style="bold"),
+        "danger": lambda text: color(text, "red", style="bold"),
+        "info": lambda text: color(text, "cyan", style="bold"),
+    }
+
+
+# functions available to explanation f-strings, indexed by colorize_output
+TEMPLATE_HELPERS = {
+    False: get_template_helpers(False),
+    True: get_template_helpers(True),
+}
+
 
-        f_string = self.explanation
-        f_string = re.sub(r"\*\*\{(.*?)\}\*\*", r"{emphasize(\1)}", f_string)
-        f_string = re.sub(r"\*\*(.*?)\*\*", r"{emphasize('\1')}", f_string)
-        f_string = 'f"""' + f_string + '"""'
+def required_literal(regex):
+    """
+    return the longest string, lower-cased, which must appear in any text regex matches
+    "" if none is found, e.g. because regex has a top-level alternation
+    """
+    # a top-level | means no literal is required
+    depth = 0
+    j = 0
+    while j < len(regex):
+        c = regex[j]
+        if c == "\\":
+            j += 2
+            continue
+        if c == "[":
+            j = skip_character_class(regex, j)
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            return ""
+        j += 1
+    runs = [""]
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        if c in "?*{":
+            # the preceding character is optional
+            runs[-1] = runs[-1][:-1]
+            runs.append("")
+            if c == "{":
+                i = regex.find("}", i) + 1 or len(regex)
+            else:
+                i += 1
+            if i < len(regex) and regex[i] == "?":
+                i += 1
+            continue
+        if c == "+":
+            runs.append("")
+            i += 1
+            continue
+        if c == "\\" and i + 1 < len(regex):
+            escaped = regex[i + 1]
+            if escaped.isalnum():
+                # a character class, assertion or back-reference
+                runs.append("")
+            else:
+                runs[-1] += escaped
+            i += 2
+            continue
+        if c == "[":
+            i = skip_character_class(regex, i)
+            runs.append("")
+            continue
+        if c == "(":
+            i = skip_group(regex, i)
+            runs.append("")
+            continue
+        if c in ".^$)|":
+            runs.append("")
+            i += 1
+            continue
+        runs[-1] += c
+        i += 1
+    return max(runs, key=len).lower()
 
-        return eval(f_string, globals(), parameters)
+
+def skip_character_class(regex, i):
+    """
+    return the index after the character class starting at regex[i]
+    """
+    i += 1
+    if i < len(regex) and regex[i] == "^":
+        i += 1
+    if i < len(regex) and regex[i] == "]":
+        i += 1
+    while i < len(regex) and regex[i] != "]":
+        i += 2 if regex[i] == "\\" else 1
+    return i + 1
+
+
+def skip_group(regex, i):
+    """
+    return the index after the group starting at regex[i]
+    """
+    depth = 0
+    while i < len(regex):
+        c = regex[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "[":
+            i = skip_character_class(regex, i)
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
 
 
 explanations = [
     Explanation(
         label="two_main_functions",
-        regex=r"multiple definition of \W*main\b",
+        # GNU ld, lld & mold wordings, mold puts the object files before the symbol
+        regex=r"(?:multiple definition of \W*|duplicate symbol: (?:\S+: )*)main\b",
         explanation="Your program contains more than one main function - a C program can only contain one main function.",
         reproduce="""\
 // hack to get 2 main functions compiled in separate files
 //dcc_flags=$src_file
+//dcc_flags="$src_file -fuse-ld=lld"
 int main(void) {
 }
 """,
     ),
     Explanation(
         label="no_main_function",
-        regex=r"undefined reference to \W*main\b",
+        regex=r"(?:undefined reference to \W*|undefined symbol: )main\b",
         explanation="Your program does not contain a main function - a C program must contain a main function.",
         no_following_explanations=True,
         reproduce="""\
@@ -640,18 +809,6 @@ int main(void) {
     for (int i = 0; i < 10 i++) {
     }
 }
-""",
-    ),
-    Explanation(
-        regex=r"expression result unused",
-        explanation="""\
-you are doing nothing with a value on line {line_number} of {file}.
-Did you mean to assign it to a varable?
-""",
-        reproduce="""\
-int main(int argc, char *argv[]) {
-    argc;
-}
 """,
     ),
     Explanation(
@@ -693,7 +850,8 @@ int main(void) {
 """,
     ),
     Explanation(
-        regex=r"has empty body",
+        label="has_empty_body",
+        flag="-Wempty-body",
         precondition=lambda message, match: ";"
         in "".join(message.text_without_ansi_codes),
         explanation="""\
@@ -731,6 +889,20 @@ Did you mean to assign it to a variable?
 int main(int argc, char *argv[]) {
     atoi(argv[0]);
 }
+""",
+    ),
+    Explanation(
+        label="expression_result_unused",
+        # after explanations of more specific -Wunused-value warnings
+        flag="-Wunused-value",
+        explanation="""\
+you are doing nothing with a value on line {line_number} of {file}.
+Did you mean to assign it to a varable?
+""",
+        reproduce="""\
+int main(int argc, char *argv[]) {
+    argc;
+}
 """,
     ),
     Explanation(
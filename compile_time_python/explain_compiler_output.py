@@ -1,12 +1,36 @@
-import json, os, re, subprocess, sys
+import collections, json, os, re, subprocess, sys
 import colors, util
 from compiler_explanations import get_explanation
 
 ANSI_DEFAULT = "\033[0m"
 
-
-def explain_compiler_output(output, args):
-    lines = output.splitlines()
+# the first line of a compiler message, e.g. "prog.c:3:5: error: ..."
+MESSAGE_RE = re.compile(r"^(\S.*?):(\d+):")
+MESSAGE_TYPE_RE = re.compile(r"^\S.*?:\d+:(\d+):\s*(.*?):")
+NEXT_MESSAGE_RE = re.compile(r"^\S.*:\d+:")
+NOTE_RE = re.compile(r"^\S.*?:\d+:\d+:\s*note:")
+# the first line of a message from lld or mold, which have no location, e.g.
+# "ld.lld: error: undefined symbol: main"
+LINKER_MESSAGE_RE = re.compile(r"^(?:\S*ld\.lld|mold): (error|warning): ")
+# a location in the lines following an lld message, e.g. ">>> defined at prog.c:3"
+LINKER_LOCATION_RE = re.compile(r"^>>> (?:defined at|referenced by) (\S+?):(\d+)")
+# a line marking a column of the previous line, e.g. "      ^~~~"
+CARET_LINE_RE = re.compile(r"^[ ~\d|]*\^[ ~]*$")
+HIGHLIGHT_RE = re.compile(r"^(.*)\^~+")
+UNDERLINE_RE = re.compile(r"^(.*?)~+")
+WORD_RE = re.compile(r"^\w*")
+# the warning option at the end of a message, e.g. "[-Wunused-variable]"
+FLAG_RE = re.compile(r"\[(?:[^\]]*,)?(-W[^\],]+)\]$")
+
+
+def explain_compiler_output(output, args, diagnostics=None):
+    """
+    print output, explaining the compiler messages in it
+    diagnostics, if supplied, are the compiler's structured diagnostics
+    see serialized_diagnostics.read_serialized_diagnostics
+    return the explanations made
+    """
+    diagnostics = collections.deque(d for d in diagnostics or [] if d.line)
     explanations_made = set()
     errors_explained = 0
     messages = []
@@ -15,15 +39,16 @@ def explain_compiler_output(output, args):
         color = colors.color
     else:
         color = lambda text, color_name: text
-    while lines and (
-        not errors_explained or len(explanations_made) < args.max_explanations
-    ):
-        message, lines = get_next_message(lines)
+    for message in parse_compiler_output(output.splitlines()):
+        if errors_explained and len(explanations_made) >= args.max_explanations:
+            break
         if args.debug > 2:
             print("message", message, file=sys.stderr)
-        if not message:
-            print(lines.pop(0), file=sys.stderr)
+        if isinstance(message, str):
+            print(message, file=sys.stderr)
             continue
+        if diagnostics:
+            use_diagnostic(message, diagnostics)
 
         if (
             messages
@@ -139,6 +164,8 @@ class Message:
         self.note_without_ansi_codes = []
         self.highlighted_word = ""
         self.underlined_word = ""
+        # the warning option controlling the message, e.g. "-Wunused-variable"
+        self.flag = ""
 
     def is_same_line(self, message):
         return message and (message.file, message.line_number) == (
@@ -160,66 +187,158 @@ class Message:
         return f"Message(note_without_ansi_codes='{t}', highlighted_word='{h}', underlined_word='{u}',  note_without_ansi_codes='{n}')"
 
 
-def get_next_message(lines):
-    if not lines:
-        return (None, lines)
-    line = lines[0]
-    colorless_line = convert_smart_quotes_to_dumb_quotes(colors.strip_color(line))
-    m = re.match(r"^(\S.*?):(\d+):", colorless_line)
-    if not m:
-        return (None, lines)
-    lines.pop(0)
-    e = Message()
-    e.file, e.line_number = m.groups()
-    m = re.match(r"^\S.*?:\d+:(\d+):\s*(.*?):", colorless_line)
-    if m:
-        e.column, e.type = m.groups()
+def parse_compiler_output(lines):
+    """
+    yield a Message for each compiler message in lines
+    and each line which is not part of a message as a string
+
+    each line is examined once, so the time taken is linear in the size of the output
+    which can be very large, e.g. for C++ template errors
+    """
+    lines = iter(lines)
+    line = next(lines, None)
+    colorless_line = None
+    while line is not None:
+        if colorless_line is None:
+            colorless_line = colors.strip_color(line)
+        colorless_line = convert_smart_quotes_to_dumb_quotes(colorless_line)
+        m = MESSAGE_RE.match(colorless_line)
+        if not m and LINKER_MESSAGE_RE.match(colorless_line):
+            e, line = parse_linker_message(line, colorless_line, lines)
+            yield e
+            colorless_line = None
+            continue
+        if not m:
+            yield line
+            line = next(lines, None)
+            colorless_line = None
+            continue
+        e = Message()
+        e.file, e.line_number = m.groups()
+        m = MESSAGE_TYPE_RE.match(colorless_line)
+        if m:
+            e.column, e.type = m.groups()
+        m = FLAG_RE.search(colorless_line)
+        if m:
+            e.flag = m.group(1)
+
+        e.text = [line]
+        e.text_without_ansi_codes = [colorless_line]
+        parsing_note = False
+
+        # the line after the message, if it is not part of the message
+        line = None
+        colorless_line = None
+        for next_line in lines:
+            if not next_line:
+                line = next_line
+                break
+            colorless_next_line = colors.strip_color(next_line)
+            if NEXT_MESSAGE_RE.match(colorless_next_line):
+                if NOTE_RE.match(colorless_next_line):
+                    parsing_note = True
+                else:
+                    line = next_line
+                    colorless_line = colorless_next_line
+                    break
+
+            if colorless_next_line.endswith(" generated."):
+                line = next(lines, None)
+                break
+
+            if parsing_note:
+                e.note.append(next_line)
+                e.note_without_ansi_codes.append(colorless_next_line)
+                continue
+
+            if CARET_LINE_RE.match(colorless_next_line):
+                e.highlighted_word, e.underlined_word = get_marked_words(
+                    e.text_without_ansi_codes[-1], colorless_next_line
+                )
+
+            e.text.append(next_line)
+            e.text_without_ansi_codes.append(colorless_next_line)
 
+        yield e
+
+
+def parse_linker_message(line, colorless_line, lines):
+    """
+    return a Message for the lld or mold message starting with line
+    and the line after the message
+    """
+    e = Message()
+    e.type = LINKER_MESSAGE_RE.match(colorless_line).group(1)
+    e.line_number = "0"
     e.text = [line]
     e.text_without_ansi_codes = [colorless_line]
-    parsing_note = False
+    for line in lines:
+        colorless_line = colors.strip_color(line)
+        if (
+            not line
+            or MESSAGE_RE.match(colorless_line)
+            or LINKER_MESSAGE_RE.match(colorless_line)
+        ):
+            return e, line
+        m = LINKER_LOCATION_RE.match(colorless_line)
+        if m and not e.file:
+            e.file, e.line_number = m.groups()
+        e.text.append(line)
+        e.text_without_ansi_codes.append(colorless_line)
+    return e, None
 
-    while lines:
-        next_line = lines[0]
-        if not next_line:
-            break
-        colorless_next_line = colors.strip_color(lines[0])
-        m = re.match(r"^\S.*:\d+:", colorless_next_line)
-        if m:
-            if re.match(r"^\S.*?:\d+:\d+:\s*note:", colorless_next_line):
-                parsing_note = True
-            else:
-                break
 
-        lines.pop(0)
+def get_marked_words(source_line, caret_line):
+    """
+    return the highlighted & underlined words of source_line
+    marked by caret_line, e.g. "    ~~~ ^ ~~~~"
 
-        if colorless_next_line.endswith(" generated."):
-            break
+    the highlighted word is marked by the caret and any ~ following it,
+    or is the word starting at the caret,
+    the underlined word is marked by the first sequence of ~
+    """
+    m = HIGHLIGHT_RE.match(caret_line)
+    if m:
+        highlighted_word = source_line[len(m.group(1)) : len(m.group(0))]
+    else:
+        caret_index = caret_line.index("^")
+        highlighted_word = WORD_RE.match(source_line[caret_index:]).group(0)
+    underlined_word = ""
+    m = UNDERLINE_RE.match(caret_line)
+    if m:
+        underlined_word = source_line[len(m.group(1)) : len(m.group(0))]
+    return highlighted_word, underlined_word
 
-        if parsing_note:
-            e.note.append(next_line)
-            e.note_without_ansi_codes.append(colorless_next_line)
-            continue
 
-        if re.match(r"^[ ~\d|]*\^[ ~]*$", colorless_next_line):
-            previous_line = e.text_without_ansi_codes[-1]
-            m = re.match(r"^(.*)\^~+", colorless_next_line)
-            if m:
-                e.highlighted_word = previous_line[len(m.group(1)) : len(m.group(0))]
-            else:
-                caret_index = colorless_next_line.index("^")
-                m = re.match(r"^\w*", previous_line[caret_index:])
-                e.highlighted_word = m.group(0)
-
-            e.underlined_word = ""
-            m = re.match(r"^(.*?)~+", colorless_next_line)
-            if m:
-                e.underlined_word = previous_line[len(m.group(1)) : len(m.group(0))]
-
-        e.text.append(next_line)
-        e.text_without_ansi_codes.append(colorless_next_line)
-
-    return (e, lines)
+def use_diagnostic(message, diagnostics):
+    """
+    if the first of diagnostics, a deque of structured diagnostics, is for message
+    remove it and replace the fields of message found by parsing the compiler's text
+    """
+    d = diagnostics[0]
+    location = (d.filename, str(d.line), str(d.column))
+    if location != (message.file, message.line_number, message.column):
+        return
+    diagnostics.popleft()
+    message.type = d.type
+    message.flag = d.flag
+    # columns are byte offsets, so the source line is examined as bytes
+    source_line = util.fileline(d.filename, d.line).rstrip("\n")
+    source_line = source_line.encode("utf-8").decode("latin-1")
+    if not source_line or d.column > len(source_line) + 1:
+        return
+    caret_line = [" "] * (len(source_line) + 1)
+    for start_line, start_column, end_line, end_column in d.ranges:
+        if start_line > d.line or end_line < d.line:
+            continue
+        start = start_column - 1 if start_line == d.line else 0
+        end = end_column - 1 if end_line == d.line else len(source_line)
+        caret_line[start:end] = "~" * len(caret_line[start:end])
+    caret_line[d.column - 1] = "^"
+    words = get_marked_words(source_line, "".join(caret_line).rstrip())
+    message.highlighted_word, message.underlined_word = [
+        w.encode("latin-1").decode("utf-8", errors="replace") for w in words
+    ]
 
 
 def convert_smart_quotes_to_dumb_quotes(string):
@@ -0,0 +1,111 @@
+# the results of scanning source files for #include lines are kept
+# in a small file in the cache directory, so unchanged files,
+# e.g. the headers of a large project, are not re-read by every dcc invocation
+#
+# a file's result is reused only if its inode, size, modification time
+# & status change time are unchanged, as in ccache -
+# the status change time catches edits whose modification time is restored,
+# e.g. by touch -r, because it can not be set by the user
+
+import hashlib, json, os, re, time
+from cache import write_file_atomically
+
+INCLUDE_INDEX_BASENAME = "includes.json"
+
+# a file modified this recently might be modified again without its
+# modification or status change time changing, on filesystems with coarse timestamps,
+# so its result is not saved
+RACY_MODIFICATION_SECONDS = 2
+
+# the saved results are discarded if they grow larger than this
+MAX_SAVED_FILES = 4096
+
+# matches every preprocessor directive, capturing the file named by an #include
+DIRECTIVE_RE = re.compile(
+    rb'^[ \t]*#[ \t]*(?:include[ \t]*(?:"([^"\n]*)"|<([^>\n]*)>))?', re.MULTILINE
+)
+
+
+class IncludeIndex:
+    def __init__(self, directory, debug=0):
+        self.debug = debug
+        self.files = self.load(directory)
+        self.changed = False
+
+    def load(self, directory):
+        if not directory:
+            return {}
+        pathname = os.path.join(directory, INCLUDE_INDEX_BASENAME)
+        try:
+            with open(pathname, encoding="utf-8") as f:
+                return dict(json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            if self.debug > 1 and not isinstance(e, FileNotFoundError):
+                print("include index load", pathname, e)
+            return {}
+
+    def save(self, directory):
+        """
+        save the results, if they have changed, in directory
+        """
+        if not self.changed or not directory:
+            return
+        if len(self.files) > MAX_SAVED_FILES:
+            self.files = {}
+        try:
+            write_file_atomically(
+                os.path.join(directory, INCLUDE_INDEX_BASENAME),
+                json.dumps(self.files).encode("utf-8"),
+            )
+            self.changed = False
+        except OSError as e:
+            if self.debug:
+                print("include index save", directory, e)
+
+    def scan(self, pathname):
+        """
+        return a dict describing the preprocessor directives in pathname:
+
+          "includes"        - files named by #include "..."
+          "system_includes" - files named by #include <...>
+          "directive_before_system_include" - True if a directive precedes
+                                              an #include <...>
+          "digest"          - SHA-256 hex digest of the file's contents
+
+        raises OSError if pathname can not be read
+        """
+        s = os.stat(pathname)
+        key = f"{s.st_dev}:{s.st_ino}:{s.st_size}:{s.st_mtime_ns}:{s.st_ctime_ns}"
+        absolute_pathname = os.path.abspath(pathname)
+        result = self.files.get(absolute_pathname)
+        if isinstance(result, dict) and result.get("key") == key:
+            return result
+        with open(pathname, "rb") as f:
+            contents = f.read()
+        result = scan_directives(contents)
+        result["key"] = key
+        if time.time() - max(s.st_mtime, s.st_ctime) > RACY_MODIFICATION_SECONDS:
+            self.files[absolute_pathname] = result
+            self.changed = True
+        return result
+
+
+def scan_directives(contents):
+    includes = []
+    system_includes = []
+    directive_seen = False
+    directive_before_system_include = False
+    for m in DIRECTIVE_RE.finditer(contents):
+        if m.group(2) is not None:
+            system_includes.append(m.group(2).decode("utf-8", errors="replace"))
+            directive_before_system_include |= directive_seen
+            continue
+        if m.group(1) is not None:
+            includes.append(m.group(1).decode("utf-8", errors="replace"))
+        directive_seen = True
+    return {
+        "includes": includes,
+        "system_includes": system_includes,
+        "directive_before_system_include": directive_before_system_include,
+        "digest": hashlib.sha256(contents).hexdigest(),
+    }
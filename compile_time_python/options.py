@@ -1,6 +1,7 @@
-import io, os, platform, re, subprocess, sys, tarfile
+import os, re, subprocess, sys, tempfile
 from version import VERSION
-from util import search_path
+from include_index import IncludeIndex
+from probe import ToolchainProbe
 
 
 # on some platforms -Wno-unused-result is needed
@@ -37,6 +38,10 @@ COMPILE_HELPER_BASENAME = "dcc-compile-helper"
 
 COMPILE_LOGGER_BASENAME = "dcc-compile-logger"
 
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+SYSTEM_CACHE_DIRECTORY = "/var/cache/dcc"
+
 
 # gcc detects some typical novice programmer mistakes that clang doesn't
 # We run gcc has an extra checking pass with several warnings options enabled
@@ -61,12 +66,53 @@ GCC_ONLY_ARGS = """
 	""".split()
 
 
+class lazy_attribute:
+    """
+    decorator for an Options attribute whose value is computed when first used
+    the attribute can also be assigned, e.g. from a command-line argument
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.name = function.__name__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = self.function(instance)
+        # the instance attribute hides this descriptor, so function is called once
+        setattr(instance, self.name, value)
+        return value
+
+
 class Options:
     def __init__(self):
         self.debug = int(os.environ.get("DCC_DEBUG", "0"))
 
-        # macOS has clang renamed as gcc - but it doesn't take gcc options
-        self.also_run_gcc = sys.platform != "darwin" and search_path("gcc")
+        # record time taken by phases of the compilation, see profiling.py
+        self.profile_pathname = os.environ.get("DCC_PROFILE", "")
+        self.profile_phases = bool(self.profile_pathname)
+
+        # persistent cache of build products, e.g. compiled wrapper code
+        # see cache.py
+        self.cache_directory = os.environ.get(
+            "DCC_CACHE_DIR", default_cache_directory()
+        )
+        self.system_cache_directory = os.environ.get(
+            "DCC_SYSTEM_CACHE_DIR", SYSTEM_CACHE_DIRECTORY
+        )
+        try:
+            self.cache_max_bytes = int(
+                os.environ.get("DCC_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)
+            )
+        except ValueError:
+            self.cache_max_bytes = DEFAULT_CACHE_MAX_BYTES
+        # DCC_NO_BUILD_CACHE disables caching whole builds, e.g. for dcc --prebuild
+        self.build_cache = not os.environ.get("DCC_NO_BUILD_CACHE")
+
+        # the probe, include_index, also_run_gcc, compile_helper & compile_logger
+        # attributes are computed when first used, see lazy_attribute below,
+        # so invocations such as dcc --version do no unnecessary work
 
         self.basename = os.path.basename(sys.argv[0])
         self.cpp_mode = self.basename.endswith("++")
@@ -75,8 +121,8 @@ class Options:
         self.save_stdin_buffer_size = 10240
         self.valgrind_fix_posix_spawn = None
 
-        self.dcc_supplied_compiler_args = COMMON_COMPILER_ARGS
-        self.dcc_supplied_linker_args = IMPLICIT_LINKER_ARGS
+        self.dcc_supplied_compiler_args = list(COMMON_COMPILER_ARGS)
+        self.dcc_supplied_linker_args = list(IMPLICIT_LINKER_ARGS)
         self.c_compiler = ""
 
         # needed for shared-libasan
@@ -156,31 +202,80 @@ class Options:
         self.object_pathname = "a.out"
         self.sanitizers = []
         self.shared_libasan = None
+        # the user's files embedded in the executable, see compile.create_source_tarfile
         self.source_files = set()
+        # all files read while scanning source files for includes
+        self.dependency_files = set()
+        # SHA-256 hex digests of the contents of dependency_files
+        self.dependency_digests = {}
+        # files named by #include "..." in the files scanned
+        self.included_files = set()
+        # set if the compiler might read files not in dependency_files
+        self.untracked_dependencies = False
         self.stack_use_after_return = None
         self.suppressions_file = os.devnull
         self.system_includes_used = set()
-
-        self.tar_buffer = io.BytesIO()
-        # pylint: disable=consider-using-with
-        self.tar = tarfile.open(fileobj=self.tar_buffer, mode="w|xz", dereference=True)
+        # set if a preprocessor directive precedes a system include
+        # so the system includes can not be replaced by a precompiled header
+        self.directives_before_system_includes = False
+        # cached results of scanning the user's code, see compile.user_may_define
+        self.user_definitions = {}
+        self.user_source_text = None
+        # see compile.undefined_behaviour_sanitizer_links
+        self.undefined_behaviour_sanitizer_links = None
+        # see compile.get_linker_arguments
+        self.linker_arguments = None
+        # see compile.ErrorMonitor
+        self.error_monitor = None
+        # if set, clang's structured diagnostics are used to explain its output
+        self.structured_diagnostics = False
 
         self.threads_used = False
         self.treat_warnings_as_errors = False
         self.user_supplied_compiler_args = []
-        self.compile_helper = os.environ.get("DCC_COMPILE_HELPER", "") or search_path(
+        self.embedded_environment_variables = []
+
+    @lazy_attribute
+    def probe(self):
+        # results of searching $PATH & running clang --version
+        # saved between invocations, see probe.py
+        return ToolchainProbe(
+            self.cache_directory, self.system_cache_directory, debug=self.debug
+        )
+
+    @lazy_attribute
+    def include_index(self):
+        # results of scanning source files for includes
+        # saved between invocations, see include_index.py
+        return IncludeIndex(self.cache_directory, debug=self.debug)
+
+    @lazy_attribute
+    def also_run_gcc(self):
+        # macOS has clang renamed as gcc - but it doesn't take gcc options
+        return sys.platform != "darwin" and self.probe.search_path("gcc")
+
+    @lazy_attribute
+    def compile_helper(self):
+        return os.environ.get("DCC_COMPILE_HELPER", "") or self.probe.search_path(
             COMPILE_HELPER_BASENAME
         )
-        self.compile_logger = os.environ.get("DCC_COMPILE_LOGGER", "") or search_path(
+
+    @lazy_attribute
+    def compile_logger(self):
+        return os.environ.get("DCC_COMPILE_LOGGER", "") or self.probe.search_path(
             COMPILE_LOGGER_BASENAME
         )
-        self.embedded_environment_variables = []
+
+    def save_cached_results(self):
+        """
+        save the probe & include index results, if they were used
+        """
+        for name in ["probe", "include_index"]:
+            if name in vars(self):
+                getattr(self, name).save(self.cache_directory)
 
     def die(self, *args, **kwargs):
         self.warn(*args, **kwargs)
-        # if the tar is not closed an execption is raised on exit by python 3.9
-        if self.tar:
-            self.tar.close()
         sys.exit(1)
 
     def warn(self, *args, **kwargs):
@@ -194,6 +289,22 @@ class Options:
             print(*args, **kwargs)
 
 
+def is_32_bit():
+    # platform.architecture() runs file(1) on the Python interpreter,
+    # sys.maxsize gives the same answer without running a program
+    return sys.maxsize <= 2**32
+
+
+def default_cache_directory():
+    cache_home = os.environ.get("XDG_CACHE_HOME", "")
+    if not cache_home:
+        try:
+            cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+        except (KeyError, RuntimeError):
+            return ""
+    return os.path.join(cache_home, "dcc")
+
+
 def get_options():
     options = parse_args(sys.argv[1:])
 
@@ -250,7 +361,7 @@ def get_options():
                 )
             else:
                 options.sanitizers = ["address"]
-        elif search_path("valgrind"):
+        elif options.probe.search_path("valgrind"):
             options.sanitizers = ["address", "valgrind"]
         else:
             options.sanitizers = ["address", "memory"]
@@ -261,14 +372,14 @@ def get_options():
     if options.valgrind_fix_posix_spawn is None and "valgrind" in options.sanitizers:
         options.valgrind_fix_posix_spawn = sys.platform == "linux"
 
-    if "memory" in options.sanitizers and platform.architecture()[0][0:2] == "32":
+    if "memory" in options.sanitizers and is_32_bit():
         options.die("MemorySanitizer not available on 32-bit architectures")
 
     if "clang" in options.c_compiler:
         options.dcc_supplied_compiler_args += CLANG_ONLY_ARGS
     elif "gcc" in options.c_compiler:
         options.dcc_supplied_compiler_args += GCC_ONLY_ARGS
-    if "address" in options.sanitizers and platform.architecture()[0][0:2] == "32":
+    if "address" in options.sanitizers and is_32_bit():
         libc_version = get_libc_version(options)
 
         if libc_version and options.clang_version_float < 6 and libc_version >= 2.27:
@@ -298,6 +409,8 @@ def get_options():
 
     if options.object_files_being_linked and len(options.sanitizers) > 1:
         options.die("only a single sanitizer supported with linking of .o files")
+
+    options.save_cached_results()
     return options
 
 
@@ -331,7 +444,9 @@ def parse_arg(arg, remaining_args, options):
         sanitizer_list = arg[len("-fsanitize=") :].split(",")
         for sanitizer in sanitizer_list:
             if sanitizer in ["memory", "address", "valgrind"]:
-                if sanitizer == "valgrind" and not search_path("valgrind"):
+                if sanitizer == "valgrind" and not options.probe.search_path(
+                    "valgrind"
+                ):
                     options.warn("warning: valgrind does not seem be installed")
                 options.sanitizers.append(sanitizer)
             elif sanitizer not in ["undefined"]:
@@ -352,6 +467,10 @@ def parse_arg(arg, remaining_args, options):
         options.explanations = True
     elif arg == "--no-explanations":
         options.explanations = False
+    elif arg == "--structured-diagnostics":
+        options.structured_diagnostics = True
+    elif arg == "--no-structured-diagnostics":
+        options.structured_diagnostics = False
     elif arg == "--shared-libasan" or arg == "-shared-libasan":
         options.shared_libasan = True
     # support both spelling for backwards compatibility
@@ -369,8 +488,13 @@ def parse_arg(arg, remaining_args, options):
         options.ifdef_instead_of_wrap = True
     elif arg.startswith("--c-compiler="):
         options.c_compiler = arg[arg.index("=") + 1 :]
-        if not search_path(options.c_compiler):
+        if not options.probe.search_path(options.c_compiler):
             options.die(f"{options.c_compiler} not found")
+    elif arg.startswith("--cache-dir="):
+        options.cache_directory = arg[len("--cache-dir=") :]
+    elif arg == "--no-cache":
+        options.cache_directory = ""
+        options.system_cache_directory = ""
     elif arg.startswith("--compile_helper="):
         options.compile_helper = arg[len("--compile_helper=") :]
     elif arg.startswith("--compile_logger="):
@@ -384,6 +508,14 @@ def parse_arg(arg, remaining_args, options):
         options.colorize_output = True
     elif arg == "-fno-color-diagnostics":
         options.colorize_output = False
+    elif arg == "--profile-phases":
+        options.profile_phases = True
+    elif arg == "--probe":
+        save_system_probe(options)
+        sys.exit(0)
+    elif arg == "--prebuild":
+        prebuild_system_cache(options)
+        sys.exit(0)
     elif arg == "-v" or arg == "--version":
         print("dcc version", VERSION)
         sys.exit(0)
@@ -450,16 +582,22 @@ def process_possible_source_file(pathname, options, processed_files):
     if extension.lower() in [".cpp", ".c++"]:
         options.cpp_mode = True
     try:
-        with open(pathname, encoding="utf-8", errors="replace") as f:
-            for line in f:
-                m = re.match(r'^\s*#\s*include\s*"(.*?)"', line)
-                if m:
-                    process_possible_source_file(m.group(1), options, processed_files)
-                m = re.match(r"^\s*#\s*include\s*<(.*?)>", line)
-                if m:
-                    options.system_includes_used.add(m.group(1))
+        scan = options.include_index.scan(pathname)
     except OSError:
         return
+    options.dependency_files.add(pathname)
+    options.dependency_digests[pathname] = scan["digest"]
+    for include in scan["includes"]:
+        # the compiler searches the directory of the including file first
+        # so it may find a different file to the one we scan
+        including_directory = os.path.dirname(os.path.normpath(pathname))
+        if including_directory or not os.path.isfile(include):
+            options.untracked_dependencies = True
+        options.included_files.add(include)
+        process_possible_source_file(include, options, processed_files)
+    options.system_includes_used.update(scan["system_includes"])
+    if scan["directive_before_system_include"]:
+        options.directives_before_system_includes = True
     # don't try to handle paths with .. or with leading /
     # should we convert argument to normalized relative path if possible
     # before passing to to compiler?
@@ -491,9 +629,7 @@ def process_possible_source_file(pathname, options, processed_files):
         if os.path.getsize(pathname) > options.maximum_source_file_embedded_bytes:
             options.debug_print("skipping", pathname, "too large", level=2)
             return
-        options.tar.add(pathname)
         options.source_files.add(pathname)
-        options.debug_print("adding", pathname, "to tar file", level=2)
     except OSError as e:
         if options.debug:
             print("process_possible_source_file", pathname, e)
@@ -504,9 +640,7 @@ def test_clang_version_exists(compiler, options):
     # apple replaces clang version with xcode release
     # which might break the workarounds below for old clang version
     try:
-        clang_version_string = subprocess.check_output(
-            [compiler, "--version"], universal_newlines=True
-        )
+        clang_version_string = options.probe.check_output([compiler, "--version"])
         options.debug_print("clang version:", clang_version_string)
         # assume little about how version is printed, e.g. because macOS mangles it
         m = re.search(r"((\d+)\.(\d+)\.\d+)", clang_version_string, flags=re.I)
@@ -531,9 +665,90 @@ def test_clang_version_exists(compiler, options):
     return False
 
 
+def save_system_probe(options):
+    """
+    probe for all programs dcc might use and save the results
+    in the system cache directory so they are available to every user,
+    e.g. from a package's post-install script
+    """
+    programs = ["gcc", "valgrind", COMPILE_HELPER_BASENAME, COMPILE_LOGGER_BASENAME]
+    for program in programs:
+        options.probe.search_path(program)
+    for clang in ["clang", "clang++"]:
+        test_clang_version_exists(clang, options)
+        for major in range(11, 31, 2):
+            test_clang_version_exists(f"{clang}-{major}", options)
+    get_libc_version(options)
+    directory = options.system_cache_directory
+    if not directory:
+        options.die("no system cache directory")
+    options.probe.changed = True
+    options.probe.save(directory)
+    if options.probe.changed:
+        options.die(f"can not save probe results in {directory}")
+    print(f"probe results saved in {directory}")
+
+
+# sanitizer options for which dcc --prebuild compiles dcc's wrapper code
+PREBUILD_ARGUMENTS = [
+    [],
+    ["--leak-check"],
+    ["-fsanitize=address"],
+    ["-fsanitize=valgrind"],
+    ["-fsanitize=memory"],
+]
+
+PREBUILD_SOURCE = "#include <stdio.h>\nint main(void) {\n    return 0;\n}\n"
+
+
+def prebuild_system_cache(options):
+    """
+    compile a trivial program with the usual dcc options, storing
+    dcc's compiled wrapper code in the system cache directory,
+    so users' compiles only need to compile their own code,
+    e.g. from a package's post-install script
+    """
+    directory = options.system_cache_directory
+    if not directory:
+        options.die("no system cache directory")
+    # only the wrapper code, probe results & include scans are useful to other users,
+    # the prebuild programs' executables would never be fetched from the cache
+    environment = dict(
+        os.environ, DCC_CACHE_DIR=directory, DCC_NO_SERVER="1", DCC_NO_BUILD_CACHE="1"
+    )
+    n_failures = 0
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        for suffix in [".c", ".cpp"]:
+            source = os.path.join(temporary_directory, "prebuild" + suffix)
+            with open(source, "w", encoding="utf-8") as f:
+                f.write(PREBUILD_SOURCE)
+            for arguments in PREBUILD_ARGUMENTS:
+                command = (
+                    [options.dcc_path]
+                    + arguments
+                    + [source, "-o", os.path.join(temporary_directory, "a.out")]
+                )
+                p = subprocess.run(
+                    command,
+                    env=environment,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    universal_newlines=True,
+                )
+                description = " ".join(arguments + ["prebuild" + suffix])
+                if p.returncode == 0:
+                    print(f"prebuilt: dcc {description}")
+                else:
+                    n_failures += 1
+                    print(f"prebuild failed: dcc {description}\n{p.stdout}")
+    print(f"dcc wrapper code saved in {directory}")
+    if n_failures:
+        sys.exit(1)
+
+
 def get_libc_version(options):
     try:
-        libc_version = subprocess.check_output(["ldd", "--version"]).decode("ascii")
+        libc_version = options.probe.check_output(["ldd", "--version"])
         if options.debug:
             print("libc version:", libc_version)
         m = re.search(r"([0-9]\.[0-9]+)", libc_version)
@@ -0,0 +1,152 @@
+# results of probing the toolchain, e.g. searching $PATH for programs,
+# running clang --version and test compiles, are kept in a small file
+# in the cache directory
+# so they are not repeated by every dcc invocation
+#
+# $PATH search results are reused only if $PATH and the directories in it are unchanged
+# the output of a program is reused only if the program's inode & modification time
+# are unchanged
+#
+# dcc --probe saves the results in the system cache directory,
+# which is consulted, read-only, if a result is not in the user's probe file
+
+import json, os, subprocess
+import util
+from cache import write_file_atomically
+from profiling import profiled_popen, record_subprocess, start_subprocess_record
+
+PROBE_FILE_BASENAME = "probe.json"
+
+# the saved output of programs is discarded if it grows larger than this
+MAX_SAVED_OUTPUTS = 256
+
+
+class ToolchainProbe:
+    def __init__(self, directory, system_directory="", debug=0):
+        self.debug = debug
+        self.path_key = get_path_key()
+        self.results = self.load(directory)
+        self.system_results = self.load(system_directory)
+        self.changed = False
+
+    def load(self, directory):
+        results = {"path_key": self.path_key, "search_path": {}, "output": {}}
+        if not directory:
+            return results
+        pathname = os.path.join(directory, PROBE_FILE_BASENAME)
+        try:
+            with open(pathname, encoding="utf-8") as f:
+                saved = json.load(f)
+            results["output"] = dict(saved["output"])
+            if saved["path_key"] == self.path_key:
+                results["search_path"] = dict(saved["search_path"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if self.debug > 1 and not isinstance(e, FileNotFoundError):
+                print("probe load", pathname, e)
+        return results
+
+    def save(self, directory):
+        """
+        save the results, if they have changed, in directory
+        the file is replaced atomically so concurrent dcc processes can read it
+        """
+        if not self.changed or not directory:
+            return
+        if len(self.results["output"]) > MAX_SAVED_OUTPUTS:
+            self.results["output"] = {}
+        try:
+            write_file_atomically(
+                os.path.join(directory, PROBE_FILE_BASENAME),
+                json.dumps(self.results).encode("utf-8"),
+            )
+            self.changed = False
+        except OSError as e:
+            if self.debug:
+                print("probe save", directory, e)
+
+    def search_path(self, program):
+        """
+        return absolute pathname for first instance of program in $PATH, None otherwise
+        """
+        if os.path.isabs(program) or os.sep in program:
+            return util.search_path(program)
+        for results in [self.results, self.system_results]:
+            if program in results["search_path"]:
+                return results["search_path"][program]
+        pathname = util.search_path(program)
+        self.results["search_path"][program] = pathname
+        self.changed = True
+        return pathname
+
+    def check_output(self, command):
+        """
+        return the output of command as a string, like subprocess.check_output
+        """
+        return self.cached_result(command[0], command[1:], lambda: run_probe(command))
+
+    def cached_result(self, program, arguments, compute):
+        """
+        return compute(), a JSON-serializable value which must depend only
+        on program & the list of strings arguments
+        a saved value is returned if program is unchanged since it was saved
+        """
+        if not os.path.isabs(program):
+            name = program
+            program = self.search_path(program)
+            if not program:
+                raise FileNotFoundError(f"{name} not found")
+        try:
+            pathname = os.path.realpath(program)
+            s = os.stat(pathname)
+        except OSError:
+            return compute()
+        key = "\0".join(
+            [f"{pathname}:{s.st_dev}:{s.st_ino}:{s.st_size}:{s.st_mtime_ns}"]
+            + arguments
+        )
+        for results in [self.results, self.system_results]:
+            if key in results["output"]:
+                return results["output"][key]
+        result = compute()
+        self.results["output"][key] = result
+        self.changed = True
+        return result
+
+
+def run_probe(command):
+    """
+    return the output of command, like subprocess.check_output
+    """
+    before = start_subprocess_record()
+    returncode = None
+    process = None
+    try:
+        with profiled_popen(
+            command, stdout=subprocess.PIPE, universal_newlines=True
+        ) as process:
+            try:
+                output, _ = process.communicate()
+            except BaseException:
+                process.kill()
+                raise
+        returncode = process.returncode
+    finally:
+        record_subprocess(command, returncode, before, process)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command, output)
+    return output
+
+
+def get_path_key():
+    """
+    return a string which changes if the result of searching $PATH might change
+    """
+    path = os.environ.get("PATH", "")
+    components = [path]
+    for directory in path.split(os.pathsep):
+        try:
+            s = os.stat(directory or ".")
+            components.append(f"{s.st_dev}:{s.st_ino}:{s.st_mtime_ns}")
+        except OSError:
+            components.append("")
+    return "\0".join(components)
@@ -0,0 +1,188 @@
+# record the time taken by the phases of a compilation & by each subprocess run
+#
+# if the environment variable DCC_PROFILE is set to a pathname,
+# or --profile-phases is given, the records are written as JSON when dcc finishes,
+# to that pathname or to stderr, and are added to the information passed
+# to the compile logger
+#
+# each record has wall & CPU time, CPU time of child processes & peak resident memory
+# for a phase, CPU time & child resource use are for the whole dcc process,
+# so they include any phases or subprocesses running concurrently,
+# e.g. the gcc checking pass
+# for a subprocess, child resource use is for that subprocess alone, from os.wait4
+#
+# nothing is measured unless profiling is on
+
+import contextlib, functools, json, os, resource, subprocess, sys, threading, time
+
+_records = []
+_lock = threading.Lock()
+_start_time = time.perf_counter()
+_enabled = False
+
+
+def reset_profile(argv=()):
+    """
+    discard any records, and record phases & subprocesses from now on
+    if DCC_PROFILE is set or argv contains --profile-phases, see options.py
+    """
+    global _start_time, _enabled
+    with _lock:
+        _records.clear()
+        _start_time = time.perf_counter()
+        _enabled = bool(os.environ.get("DCC_PROFILE")) or "--profile-phases" in argv
+
+
+@contextlib.contextmanager
+def phase(name, **details):
+    """
+    record the resources used by the code in a with statement
+    """
+    if not _enabled:
+        yield
+        return
+    before = _measure()
+    try:
+        yield
+    finally:
+        _add_record(name, before, details)
+
+
+def profiled(function):
+    """
+    decorator recording the resources used by each call of function as a phase
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with phase(function.__name__):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def profiled_popen(*args, **kwargs):
+    """
+    return subprocess.Popen(*args, **kwargs), a ProfiledPopen if profiling is on
+    """
+    if _enabled:
+        return ProfiledPopen(*args, **kwargs)
+    return subprocess.Popen(*args, **kwargs)
+
+
+class ProfiledPopen(subprocess.Popen):
+    """
+    a subprocess.Popen which saves, in resource_usage, the resources used
+    by the process, os.wait4 returns these for the process alone
+
+    it overrides private methods of subprocess.Popen,
+    so it is only used when profiling is on, see profiled_popen
+    """
+
+    resource_usage = None
+
+    def _wait4(self, pid, wait_flags):
+        pid, status, usage = os.wait4(pid, wait_flags)
+        if pid:
+            self.resource_usage = usage
+        return (pid, status)
+
+    # subprocess.Popen waits for the process in these two methods,
+    # in wait & communicate, and in poll & kill
+    def _try_wait(self, wait_flags):
+        try:
+            return self._wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return super()._try_wait(wait_flags)
+
+    def _internal_poll(self, _deadstate=None):
+        return super()._internal_poll(_deadstate, _waitpid=self._wait4)
+
+
+def start_subprocess_record():
+    """
+    return a value to pass to record_subprocess when the subprocess finishes
+    """
+    return _measure() if _enabled else None
+
+
+def record_subprocess(command, returncode, before, process=None):
+    """
+    process, if supplied, is the subprocess.Popen returned by profiled_popen
+    """
+    if before is None:
+        return
+    usage = getattr(process, "resource_usage", None)
+    details = {"command": list(command), "exit_status": returncode}
+    details["children_cpu"] = None
+    details["children_max_rss_kb"] = None
+    if usage:
+        details["children_cpu"] = usage.ru_utime + usage.ru_stime
+        details["children_max_rss_kb"] = usage.ru_maxrss // _rss_divisor()
+    _add_record("subprocess", before, details)
+
+
+def profile_results():
+    """
+    return the records & totals for this compilation
+    """
+    with _lock:
+        records = list(_records)
+    total = _measure()
+    return {
+        "wall": total["time"] - _start_time,
+        "cpu": total["cpu"],
+        "children_cpu": total["children_cpu"],
+        "max_rss_kb": total["max_rss_kb"],
+        "children_max_rss_kb": total["children_max_rss_kb"],
+        "phases": records,
+    }
+
+
+def write_profile(options):
+    if not options.profile_phases:
+        return
+    results = json.dumps(profile_results(), indent=1)
+    if not options.profile_pathname:
+        print(results, file=sys.stderr)
+        return
+    try:
+        with open(options.profile_pathname, "w", encoding="utf-8") as f:
+            f.write(results + "\n")
+    except OSError as e:
+        options.warn(f"can not write profile to {options.profile_pathname}: {e}")
+
+
+def _measure():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    rss_divisor = _rss_divisor()
+    return {
+        "time": time.perf_counter(),
+        "cpu": time.process_time(),
+        "children_cpu": children_usage.ru_utime + children_usage.ru_stime,
+        "max_rss_kb": self_usage.ru_maxrss // rss_divisor,
+        "children_max_rss_kb": children_usage.ru_maxrss // rss_divisor,
+    }
+
+
+def _rss_divisor():
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return 1024 if sys.platform == "darwin" else 1
+
+
+def _add_record(name, before, details):
+    after = _measure()
+    record = {
+        "name": name,
+        "start": before["time"] - _start_time,
+        "wall": after["time"] - before["time"],
+        "cpu": after["cpu"] - before["cpu"],
+        "children_cpu": after["children_cpu"] - before["children_cpu"],
+        "max_rss_kb": after["max_rss_kb"],
+        "children_max_rss_kb": after["children_max_rss_kb"],
+        "thread": threading.current_thread().name,
+    }
+    record.update(details)
+    with _lock:
+        _records.append(record)
@@ -0,0 +1,344 @@
+# read the diagnostics clang writes with --serialize-diagnostics
+#
+# the file is an LLVM bitstream, see https://llvm.org/docs/BitCodeFormat.html
+# its records are described in clang/include/clang/Frontend/SerializedDiagnostics.h
+#
+# only the parts of the bitstream format clang uses for this file are handled
+
+MAGIC = b"DIAG"
+
+# abbreviation ids with a fixed meaning
+END_BLOCK = 0
+ENTER_SUBBLOCK = 1
+DEFINE_ABBREV = 2
+UNABBREV_RECORD = 3
+FIRST_APPLICATION_ABBREV = 4
+
+BLOCKINFO_BLOCK_ID = 0
+BLOCKINFO_SETBID = 1
+
+# each diagnostic is in a block, its notes are in blocks nested within it
+DIAG_BLOCK_ID = 9
+
+# abbreviation operand encodings
+FIXED = 1
+VBR = 2
+ARRAY = 3
+CHAR6 = 4
+BLOB = 5
+CHAR6_CHARACTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._"
+
+RECORD_DIAG = 2
+RECORD_SOURCE_RANGE = 3
+RECORD_DIAG_FLAG = 4
+RECORD_CATEGORY = 5
+RECORD_FILENAME = 6
+
+# the number of operands before the blob, for records ending with a blob
+BLOB_OFFSETS = {
+    RECORD_DIAG: 8,
+    RECORD_DIAG_FLAG: 2,
+    RECORD_CATEGORY: 2,
+    RECORD_FILENAME: 4,
+}
+
+# clang's diagnostic levels, named as in its text output
+LEVELS = ["ignored", "note", "warning", "error", "fatal error", "remark"]
+
+
+class Diagnostic:
+    """
+    a diagnostic from clang, line & column numbers start at 1
+    line is 0 if the diagnostic has no location, e.g. if it is about an option
+
+    ranges are the source ranges clang highlights, a list of tuples
+    (start line, start column, end line, end column), end column is one past the range
+    """
+
+    def __init__(self, level, filename, line, column, text, flag, category):
+        self.type = LEVELS[level] if level < len(LEVELS) else ""
+        self.filename = filename
+        self.line = line
+        self.column = column
+        self.text = text
+        # the warning option controlling the diagnostic, e.g. "-Wunused-variable"
+        self.flag = flag
+        self.category = category
+        self.ranges = []
+        self.notes = []
+
+    def __str__(self):
+        location = f"{self.filename}:{self.line}:{self.column}"
+        return f"Diagnostic({location}: {self.type}: {self.text})"
+
+
+def read_serialized_diagnostics(pathname, debug=0):
+    """
+    return a list of the diagnostics in pathname, notes are attached to the diagnostic
+    they are for
+
+    an empty list is returned if the file does not exist,
+    e.g. because the compiler was only linking,
+    None is returned if the file can not be read or is not valid
+    """
+    try:
+        with open(pathname, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    except OSError as e:
+        if debug:
+            print("read_serialized_diagnostics", pathname, e)
+        return None
+    if not data:
+        return []
+    try:
+        return parse_serialized_diagnostics(data)
+    except (ValueError, IndexError, KeyError) as e:
+        if debug:
+            print("read_serialized_diagnostics", pathname, e)
+        return None
+
+
+def diagnostics_to_json(diagnostics):
+    """
+    return diagnostics as a list of dicts which can be encoded as JSON,
+    so they can be cached with the compiler output they are for
+    """
+    return [dict(vars(d), notes=diagnostics_to_json(d.notes)) for d in diagnostics]
+
+
+def diagnostics_from_json(values):
+    """
+    return the diagnostics encoded by diagnostics_to_json
+    """
+    diagnostics = []
+    for value in values:
+        d = Diagnostic.__new__(Diagnostic)
+        d.__dict__.update(value)
+        d.ranges = [tuple(r) for r in value["ranges"]]
+        d.notes = diagnostics_from_json(value["notes"])
+        diagnostics.append(d)
+    return diagnostics
+
+
+def parse_serialized_diagnostics(data):
+    """
+    return a list of the diagnostics in data, raises ValueError if it is not valid
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError("not a serialized diagnostics file")
+    reader = BitReader(data, len(MAGIC))
+    diagnostics = []
+    filenames = {}
+    flags = {}
+    categories = {}
+    # for each enclosing diagnostic block, its diagnostic & notes
+    # a note, e.g. "in file included from", may precede its diagnostic's record
+    diagnostic_blocks = []
+
+    # abbreviations defined in the BLOCKINFO block for each block id
+    block_abbreviations = {}
+    blockinfo_block_id = None
+    block_id = None
+    abbreviation_width = 2
+    abbreviations = []
+    enclosing_blocks = []
+
+    while not reader.at_end(abbreviation_width):
+        abbreviation_id = reader.read(abbreviation_width)
+        if abbreviation_id == END_BLOCK:
+            reader.align32()
+            if not enclosing_blocks:
+                break
+            if block_id == DIAG_BLOCK_ID:
+                end_diagnostic_block(diagnostic_blocks, diagnostics)
+            block_id, abbreviation_width, abbreviations = enclosing_blocks.pop()
+        elif abbreviation_id == ENTER_SUBBLOCK:
+            enclosing_blocks.append((block_id, abbreviation_width, abbreviations))
+            block_id = reader.read_vbr(8)
+            if block_id == DIAG_BLOCK_ID:
+                diagnostic_blocks.append((None, []))
+            abbreviation_width = reader.read_vbr(4)
+            reader.align32()
+            reader.read(32)  # block length in 32-bit words
+            abbreviations = list(block_abbreviations.get(block_id, []))
+        elif abbreviation_id == DEFINE_ABBREV:
+            abbreviation = read_abbreviation(reader)
+            if block_id == BLOCKINFO_BLOCK_ID:
+                block_abbreviations.setdefault(blockinfo_block_id, []).append(
+                    abbreviation
+                )
+            else:
+                abbreviations.append(abbreviation)
+        else:
+            if abbreviation_id == UNABBREV_RECORD:
+                code = reader.read_vbr(6)
+                operands = [reader.read_vbr(6) for _ in range(reader.read_vbr(6))]
+                blob = None
+            else:
+                abbreviation = abbreviations[abbreviation_id - FIRST_APPLICATION_ABBREV]
+                code, operands, blob = read_abbreviated_record(reader, abbreviation)
+
+            if block_id == BLOCKINFO_BLOCK_ID:
+                if code == BLOCKINFO_SETBID:
+                    blockinfo_block_id = operands[0]
+                continue
+
+            if code in BLOB_OFFSETS:
+                offset = BLOB_OFFSETS[code]
+                if blob is None:
+                    # an unabbreviated record has the blob's bytes as operands
+                    blob = bytes(operand & 0xFF for operand in operands[offset:])
+                text = blob[: operands[offset - 1]].decode("utf-8", errors="replace")
+
+            if code == RECORD_FILENAME:
+                filenames[operands[0]] = text
+            elif code == RECORD_DIAG_FLAG:
+                flags[operands[0]] = "-W" + text
+            elif code == RECORD_CATEGORY:
+                categories[operands[0]] = text
+            elif code == RECORD_DIAG and diagnostic_blocks:
+                level, file_id, line, column, _, category_id, flag_id = operands[:7]
+                diagnostic = Diagnostic(
+                    level,
+                    filenames.get(file_id, ""),
+                    line,
+                    column,
+                    text,
+                    flags.get(flag_id, ""),
+                    categories.get(category_id, ""),
+                )
+                diagnostic_blocks[-1] = (diagnostic, diagnostic_blocks[-1][1])
+            elif code == RECORD_SOURCE_RANGE and diagnostic_blocks:
+                diagnostic = diagnostic_blocks[-1][0]
+                if diagnostic:
+                    # each end of the range is a file id, line, column & offset
+                    start_line, start_column = operands[1:3]
+                    end_line, end_column = operands[5:7]
+                    diagnostic.ranges.append(
+                        (start_line, start_column, end_line, end_column)
+                    )
+    if enclosing_blocks:
+        raise ValueError("serialized diagnostics truncated")
+    return diagnostics
+
+
+def end_diagnostic_block(diagnostic_blocks, diagnostics):
+    """
+    add the diagnostic of the innermost diagnostic block to the notes
+    of the enclosing diagnostic, or to diagnostics if it is not a note
+    """
+    diagnostic, notes = diagnostic_blocks.pop()
+    if not diagnostic:
+        return
+    if diagnostic_blocks:
+        # notes of notes are added to the enclosing diagnostic's notes
+        diagnostic_blocks[-1][1].extend([diagnostic] + notes)
+    else:
+        diagnostic.notes = notes
+        diagnostics.append(diagnostic)
+
+
+def read_abbreviation(reader):
+    """
+    return the operands of an abbreviation definition as (encoding, value) tuples
+    encoding is None for a literal value
+    """
+    operands = []
+    for _ in range(reader.read_vbr(5)):
+        if reader.read(1):
+            operands.append((None, reader.read_vbr(8)))
+            continue
+        encoding = reader.read(3)
+        if encoding not in [FIXED, VBR, ARRAY, CHAR6, BLOB]:
+            raise ValueError(f"unknown abbreviation encoding {encoding}")
+        value = reader.read_vbr(5) if encoding in [FIXED, VBR] else 0
+        operands.append((encoding, value))
+    return operands
+
+
+def read_abbreviated_record(reader, abbreviation):
+    """
+    return the code, operands & blob, None if there is no blob, of a record
+    """
+    values = []
+    blob = None
+    i = 0
+    while i < len(abbreviation):
+        encoding, value = abbreviation[i]
+        if encoding == ARRAY:
+            # the next operand is the encoding of the array's elements
+            i += 1
+            length = reader.read_vbr(6)
+            values.extend(read_scalar(reader, *abbreviation[i]) for _ in range(length))
+        elif encoding == BLOB:
+            length = reader.read_vbr(6)
+            reader.align32()
+            blob = reader.read_bytes(length)
+            reader.align32()
+        else:
+            values.append(read_scalar(reader, encoding, value))
+        i += 1
+    if not values:
+        raise ValueError("record has no code")
+    return values[0], values[1:], blob
+
+
+def read_scalar(reader, encoding, value):
+    if encoding is None:
+        return value
+    if encoding == FIXED:
+        return reader.read(value)
+    if encoding == VBR:
+        return reader.read_vbr(value)
+    if encoding == CHAR6:
+        return ord(CHAR6_CHARACTERS[reader.read(6)])
+    raise ValueError(f"invalid encoding {encoding} for a scalar")
+
+
+class BitReader:
+    """
+    read fields of bits, least significant bit first, from bytes
+    """
+
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.position = offset * 8
+
+    def at_end(self, width):
+        return self.position + width > len(self.data) * 8
+
+    def read(self, width):
+        if not width:
+            return 0
+        start = self.position
+        end = start + width
+        if end > len(self.data) * 8:
+            raise ValueError("serialized diagnostics truncated")
+        value = int.from_bytes(self.data[start >> 3 : (end + 7) >> 3], "little")
+        self.position = end
+        return (value >> (start & 7)) & ((1 << width) - 1)
+
+    def read_vbr(self, width):
+        continuation = 1 << (width - 1)
+        value = 0
+        shift = 0
+        while True:
+            chunk = self.read(width)
+            value |= (chunk & (continuation - 1)) << shift
+            if not chunk & continuation:
+                return value
+            shift += width - 1
+
+    def read_bytes(self, length):
+        if self.position % 8:
+            raise ValueError("unaligned read")
+        start = self.position >> 3
+        if start + length > len(self.data):
+            raise ValueError("serialized diagnostics truncated")
+        self.position += length * 8
+        return self.data[start : start + length]
+
+    def align32(self):
+        self.position = (self.position + 31) & ~31
@@ -0,0 +1,316 @@
+# dcc --server keeps a Python process running with dcc's modules loaded
+# and compiles programs for dcc processes which connect to its Unix domain socket
+#
+# the client sends its argv, current directory, environment & umask as JSON,
+# with its stdin, stdout & stderr file descriptors attached (SCM_RIGHTS)
+# the server forks a worker which tells the client it has started,
+# compiles the program writing directly to the client's stdout & stderr,
+# and then sends its exit status back to the client
+# if the client's end of the socket closes first, e.g. because it was interrupted,
+# the worker & any compiler it is running are killed
+#
+# the client compiles in-process if no server is running,
+# if the server is running a different dcc, if the server does not start
+# a worker within SERVER_START_TIMEOUT_SECONDS
+# or if the socket's directory or the server is not this user's
+#
+# this module is imported by every dcc invocation so only imports fast-loading modules
+
+import array, json, os, signal, socket, struct, sys
+
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+# a busy or hung server may not start a worker promptly
+SERVER_START_TIMEOUT_SECONDS = 5
+
+
+def server_socket_pathname():
+    pathname = os.environ.get("DCC_SERVER_SOCKET", "")
+    if pathname:
+        return pathname
+    runtime_directory = os.environ.get("XDG_RUNTIME_DIR", "")
+    if runtime_directory:
+        return os.path.join(runtime_directory, "dcc.socket")
+    return os.path.join("/tmp", f"dcc-{os.getuid()}", "dcc.socket")
+
+
+def dcc_identity():
+    """
+    return a string which changes if this dcc is replaced, e.g. by a new version
+    """
+    try:
+        pathname = os.path.realpath(sys.argv[0])
+        s = os.stat(pathname)
+        return f"{pathname}:{s.st_ino}:{s.st_size}:{s.st_mtime_ns}"
+    except OSError:
+        return ""
+
+
+def run_client():
+    """
+    run this dcc invocation on a dcc server
+    return its exit status or None if there is no server which can run it
+    """
+    if os.environ.get("DCC_NO_SERVER", ""):
+        return None
+    pathname = server_socket_pathname()
+    if not os.path.exists(pathname):
+        return None
+    # another user could create the socket, so check it is ours
+    # before sending our environment & file descriptors
+    if not socket_directory_is_private(pathname):
+        return None
+    try:
+        request = {
+            "identity": dcc_identity(),
+            "argv": sys.argv,
+            "cwd": os.getcwd(),
+            "environ": dict(os.environ),
+            "umask": get_umask(),
+        }
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(SERVER_START_TIMEOUT_SECONDS)
+            sock.connect(pathname)
+            if not peer_is_same_user(sock):
+                return None
+            send_message(sock, request, fds=[0, 1, 2])
+            reply, _ = receive_message(sock)
+            if not reply or not reply.get("started"):
+                return None
+            # the worker may now be writing to stdout & stderr,
+            # so it is waited for however long the compile takes
+            sock.settimeout(None)
+            reply, _ = receive_message(sock)
+    except (OSError, ValueError):
+        return None
+    except KeyboardInterrupt:
+        # closing the socket stops the worker
+        return 128 + signal.SIGINT
+    if not reply or "exit_status" not in reply:
+        return None
+    return reply["exit_status"]
+
+
+def serve():
+    """
+    run a dcc server until killed
+    """
+    import importlib
+
+    # load the modules a compile uses now, so every worker inherits them
+    for module in ["compile", "explain_compiler_output"]:
+        importlib.import_module(module)
+
+    max_workers = int(os.environ.get("DCC_SERVER_WORKERS", 0)) or os.cpu_count() or 1
+    identity = dcc_identity()
+    pathname = server_socket_pathname()
+    sock = create_server_socket(pathname)
+    print(f"dcc server listening on {pathname}", file=sys.stderr)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    workers = set()
+    try:
+        while True:
+            while workers:
+                # reap finished workers, waiting if too many are running
+                flags = 0 if len(workers) >= max_workers else os.WNOHANG
+                pid, _ = os.waitpid(-1, flags)
+                if not pid:
+                    break
+                workers.discard(pid)
+            connection, _ = sock.accept()
+            pid = os.fork()
+            if pid == 0:
+                sock.close()
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                try:
+                    run_worker(connection, identity)
+                finally:
+                    os._exit(0)
+            workers.add(pid)
+            connection.close()
+    except KeyboardInterrupt:
+        sys.exit(0)
+    finally:
+        sock.close()
+        if os.path.exists(pathname):
+            os.unlink(pathname)
+
+
+def create_server_socket(pathname):
+    directory = os.path.dirname(pathname)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not socket_directory_is_private(pathname):
+        print(f"dcc: {directory} is accessible by other users", file=sys.stderr)
+        sys.exit(1)
+    if os.path.exists(pathname):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as existing:
+                existing.connect(pathname)
+            print(f"dcc: a server is already listening on {pathname}", file=sys.stderr)
+            sys.exit(1)
+        except ConnectionRefusedError:
+            # left by a server which was killed
+            os.unlink(pathname)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(pathname)
+    os.chmod(pathname, 0o600)
+    sock.listen(128)
+    return sock
+
+
+def get_umask():
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def socket_directory_is_private(pathname):
+    """
+    return True if the directory containing pathname is owned by this user
+    and only accessible by them
+    a socket named by DCC_SERVER_SOCKET is chosen by the user so is not checked
+    """
+    if os.environ.get("DCC_SERVER_SOCKET", ""):
+        return True
+    try:
+        s = os.stat(os.path.dirname(pathname))
+    except OSError:
+        return False
+    return s.st_uid == os.getuid() and not s.st_mode & 0o077
+
+
+def run_worker(connection, server_identity):
+    """
+    compile a program for a client, run in a process forked by serve
+    """
+    import threading
+
+    if not peer_is_same_user(connection):
+        return
+    try:
+        request, fds = receive_message(connection, max_fds=3)
+    except (OSError, ValueError):
+        return
+    if not request or len(fds) != 3:
+        return
+    if request.get("identity") != server_identity:
+        # the client will compile in-process
+        send_message(connection, {"error": "different dcc"})
+        if dcc_identity() != server_identity:
+            # this server's dcc has been replaced
+            os.kill(os.getppid(), signal.SIGTERM)
+        return
+    # the worker & the compilers it runs are killed as a group by watch_client
+    os.setpgid(0, 0)
+    finished = threading.Event()
+    watcher = threading.Thread(
+        target=watch_client, args=(connection, finished), daemon=True
+    )
+    watcher.start()
+    send_message(connection, {"started": True})
+    for target_fd, fd in enumerate(fds):
+        os.dup2(fd, target_fd)
+        os.close(fd)
+    sys.stdin = open(0, closefd=False)
+    sys.stdout = open(1, "w", buffering=1, closefd=False)
+    sys.stderr = open(2, "w", buffering=1, closefd=False)
+    os.environ.clear()
+    os.environ.update(request["environ"])
+    os.umask(request["umask"])
+    sys.argv = request["argv"]
+    exit_status = 1
+    try:
+        os.chdir(request["cwd"])
+        exit_status = run_compile()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        finished.set()
+        send_message(connection, {"exit_status": exit_status})
+
+
+def watch_client(connection, finished):
+    """
+    kill the worker & the compilers it is running if the client closes its socket
+    before the compile is finished, run in a thread by run_worker
+    """
+    try:
+        # the client sends nothing more, so this returns when its socket closes
+        connection.recv(1)
+    except OSError:
+        pass
+    if not finished.is_set():
+        os.killpg(0, signal.SIGKILL)
+
+
+def run_compile():
+    import compile
+
+    try:
+        compile.main()
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except Exception:
+        import traceback
+
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def peer_is_same_user(connection):
+    """
+    return True if the process at the other end of connection is run by this user
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        # the socket's directory is only accessible by this user
+        return True
+    credentials = connection.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _, uid, _ = struct.unpack("3i", credentials)
+    return uid == os.getuid()
+
+
+def send_message(sock, message, fds=[]):
+    """
+    send message encoded as JSON, prefixed by its length
+    fds are file descriptors to pass with the message
+    """
+    data = json.dumps(message).encode("utf-8")
+    data = struct.pack("!I", len(data)) + data
+    ancillary = []
+    if fds:
+        ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+    n_bytes_sent = sock.sendmsg([data], ancillary)
+    sock.sendall(data[n_bytes_sent:])
+
+
+def receive_message(sock, max_fds=0):
+    """
+    return a message sent by send_message & any file descriptors sent with it
+    message is None if the connection is closed first
+    """
+    data = b""
+    fds = []
+    ancillary_size = 0
+    if max_fds:
+        ancillary_size = socket.CMSG_SPACE(max_fds * array.array("i").itemsize)
+    while len(data) < 4 or len(data) < 4 + struct.unpack("!I", data[:4])[0]:
+        chunk, ancillary, _, _ = sock.recvmsg(65536, ancillary_size if not fds else 0)
+        for level, kind, ancillary_data in ancillary:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                received = array.array("i")
+                n_bytes = len(ancillary_data) - len(ancillary_data) % received.itemsize
+                received.frombytes(ancillary_data[:n_bytes])
+                fds += list(received)
+        if not chunk:
+            return None, fds
+        data += chunk
+        if len(data) >= 4 and struct.unpack("!I", data[:4])[0] > MAX_MESSAGE_BYTES:
+            raise ValueError("message too large")
+    n_bytes = struct.unpack("!I", data[:4])[0]
+    return json.loads(data[4 : 4 + n_bytes].decode("utf-8")), fds
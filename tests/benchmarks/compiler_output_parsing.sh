@@ -0,0 +1,70 @@
+#!/bin/bash
+# check the time taken to parse & explain compiler output grows linearly with its size
+# using synthetic clang output of up to 50000 lines
+
+dcc="$(readlink -f ${1:-./dcc})"
+
+python3 - "$dcc" <<'eof'
+import contextlib, io, sys, time, types
+
+# dcc's modules are imported from the zipapp
+sys.path.insert(0, sys.argv[1])
+from explain_compiler_output import explain_compiler_output, parse_compiler_output
+
+MESSAGE = """\
+\033[1mprog.cpp:{n}:9: \033[0m\033[0;1;35mwarning: \033[0m\033[1munused variable 'v{n}' [-Wunused-variable]\033[0m
+    int v{n} = f<std::vector<std::pair<int, int>>>({n});
+\033[0;1;32m        ^
+\033[0m\033[1mprog.cpp:{n}:14: \033[0m\033[0;1;30mnote: \033[0min instantiation of function template specialization 'f<std::vector<std::pair<int, int>>>' requested here\033[0m
+    int v{n} = f<std::vector<std::pair<int, int>>>({n});
+\033[0;1;32m             ^
+\033[0m"""
+
+
+def compiler_output(n_lines):
+    messages = [MESSAGE.format(n=n) for n in range(n_lines // 6)]
+    return "".join(messages) + f"{len(messages)} warnings generated.\n"
+
+
+def best_time(function, output):
+    times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        function(output)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def parse(output):
+    for _ in parse_compiler_output(output.splitlines()):
+        pass
+
+
+args = types.SimpleNamespace(
+    colorize_output=False, debug=0, max_explanations=3, compile_helper=None
+)
+
+
+def explain(output):
+    with contextlib.redirect_stderr(io.StringIO()):
+        explain_compiler_output(output, args)
+
+
+failed = False
+small = compiler_output(5000)
+large = compiler_output(50000)
+for name, function in [("parse", parse), ("explain", explain)]:
+    small_seconds = best_time(function, small)
+    large_seconds = best_time(function, large)
+    ratio = large_seconds / small_seconds
+    print(
+        f"{name}: 5000 lines {small_seconds * 1000:.0f}ms,",
+        f"50000 lines {large_seconds * 1000:.0f}ms, ratio {ratio:.1f}",
+    )
+    # 10 times the output should take about 10 times as long, allowing for noise
+    if ratio > 15:
+        print(f"{name} time grows faster than linearly", file=sys.stderr)
+        failed = True
+
+sys.exit(1 if failed else 0)
+eof
@@ -0,0 +1,52 @@
+#!/bin/bash
+# compare the cost of rendering dcc's explanations of compiler messages
+# with explanation f-strings compiled on every use & compiled once
+
+dcc="$(readlink -f ${1:-./dcc})"
+expected_output="$(dirname "$(readlink -f "$0")")/../expected_output"
+
+python3 - "$dcc" "$expected_output" <<'eof'
+import glob, sys, timeit
+
+# dcc's modules are imported from the zipapp
+sys.path.insert(0, sys.argv[1])
+import compiler_explanations
+from explain_compiler_output import parse_compiler_output
+
+# the compiler messages in the expected output of the tests
+messages = []
+for pathname in sorted(glob.glob(f"{sys.argv[2]}/*/*clang*.txt")):
+    with open(pathname, encoding="utf-8", errors="replace") as f:
+        lines = f.read().splitlines()
+    for message in parse_compiler_output(lines):
+        if isinstance(message, str):
+            continue
+        explanation = compiler_explanations.get_explanation(message, True)
+        if explanation:
+            messages.append(message)
+
+if not messages:
+    print("no compiler messages with explanations found", file=sys.stderr)
+    sys.exit(1)
+
+
+def render_uncompiled():
+    for message in messages:
+        for e in compiler_explanations.explanations:
+            e.template = None
+        compiler_explanations.get_explanation(message, True)
+
+
+def render_compiled():
+    for message in messages:
+        compiler_explanations.get_explanation(message, True)
+
+
+results = {}
+for name, function in [("before", render_uncompiled), ("after", render_compiled)]:
+    seconds = min(timeit.repeat(function, number=10, repeat=5)) / 10
+    results[name] = seconds / len(messages) * 1e6
+    print(f"{name}: {results[name]:.1f}us per explanation ({len(messages)} messages)")
+
+sys.exit(0 if results["after"] < results["before"] else 1)
+eof
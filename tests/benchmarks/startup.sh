@@ -0,0 +1,55 @@
+#!/bin/bash
+# fail if dcc's start-up time regresses
+# the limit can be changed for slower machines with DCC_MAX_STARTUP_MS
+
+dcc="$(readlink -f ${1:-./dcc})"
+export DCC_MAX_STARTUP_MS=${DCC_MAX_STARTUP_MS:-150}
+export DCC_NO_SERVER=1
+
+python3 - "$dcc" <<'eof'
+import importlib.util, os, subprocess, sys, time, zipfile
+
+dcc = sys.argv[1]
+max_milliseconds = float(os.environ["DCC_MAX_STARTUP_MS"])
+failed = False
+
+# dcc's bytecode should be stored uncompressed & usable by this python3
+with zipfile.ZipFile(dcc) as z:
+    for info in z.infolist():
+        if not info.filename.endswith(".py") or "/" in info.filename:
+            continue
+        try:
+            bytecode = z.getinfo(info.filename + "c")
+        except KeyError:
+            print(f"{info.filename}c missing", file=sys.stderr)
+            failed = True
+            continue
+        if bytecode.compress_type != zipfile.ZIP_STORED:
+            print(f"{bytecode.filename} compressed", file=sys.stderr)
+            failed = True
+        if z.read(bytecode)[:4] != importlib.util.MAGIC_NUMBER:
+            print(f"{bytecode.filename} not for this python3", file=sys.stderr)
+
+# modules which should only be imported if there is compiler output to explain
+command = [sys.executable, "-X", "importtime", dcc, "--version"]
+p = subprocess.run(
+    command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+)
+for line in p.stderr.splitlines():
+    module = line.split("|")[-1].strip()
+    if module in ["compiler_explanations", "explain_compiler_output"]:
+        print(f"dcc --version imports {module}", file=sys.stderr)
+        failed = True
+
+# best of several runs, to exclude noise from other processes
+times = []
+for _ in range(10):
+    start = time.perf_counter()
+    subprocess.run([dcc, "--version"], stdout=subprocess.DEVNULL, check=True)
+    times.append((time.perf_counter() - start) * 1000)
+print(f"dcc --version: {min(times):.0f}ms (limit {max_milliseconds:.0f}ms)")
+if min(times) > max_milliseconds:
+    failed = True
+
+sys.exit(1 if failed else 0)
+eof
@@ -0,0 +1,62 @@
+#!/bin/bash
+# check what subprocesses of dcc --batch jobs write to stdout,
+# here a compile helper, is put in the job's messages
+# rather than mixed with the JSON results on stdout
+
+dcc=${dcc:-./dcc}
+
+export DCC_CACHE_DIR="$(pwd)/tmp_cache" DCC_NO_SERVER=1
+
+cat >tmp_helper.sh <<'eof'
+#!/bin/sh
+echo "helper output for $HELPER_FILE"
+exit 1
+eof
+chmod +x tmp_helper.sh
+export DCC_COMPILE_HELPER="$(pwd)/tmp_helper.sh"
+
+for i in 1 2 3
+do
+	cat >tmp_$i.c <<eof
+int main(void) {
+	return x$i;
+}
+eof
+done
+
+cat >tmp_manifest.json <<'eof'
+{
+	"workers": 2,
+	"jobs": [
+		{"id": "1", "sources": ["tmp_1.c"], "output": "tmp_1"},
+		{"id": "2", "sources": ["tmp_2.c"], "output": "tmp_2"},
+		{"id": "3", "sources": ["tmp_3.c"], "output": "tmp_3"}
+	]
+}
+eof
+
+$dcc --batch tmp_manifest.json >tmp_results.txt || exit 1
+
+python3 - <<'eof' || exit 1
+import json, sys
+
+with open("tmp_results.txt") as f:
+    lines = f.read().splitlines()
+ids = []
+for line in lines:
+    try:
+        result = json.loads(line)
+    except ValueError:
+        print("not a JSON result:", repr(line), file=sys.stderr)
+        sys.exit(1)
+    ids.append(result["id"])
+    expected = f"helper output for tmp_{result['id']}.c"
+    if result["exit_status"] == 0 or expected not in result["messages"]:
+        print("helper output missing from result:", result, file=sys.stderr)
+        sys.exit(1)
+if sorted(ids) != ["1", "2", "3"]:
+    print("results missing:", lines, file=sys.stderr)
+    sys.exit(1)
+eof
+
+echo All Tests Correct 1>&2
@@ -0,0 +1,213 @@
+#!/bin/bash
+# check the literal required_literal extracts from a regex, used to skip
+# explanations quickly, appears in every string the regex matches
+#
+# strings are generated from the parsed regex, trying each alternative,
+# with optional & repeated parts absent and present, and each member of
+# character classes, for every explanation's regex & some edge cases
+
+dcc=${dcc:-./dcc}
+
+python3 - "$dcc" <<'eof' || exit 1
+import sys
+
+# dcc's modules are imported from the zipapp
+sys.path.insert(0, sys.argv[1])
+from compiler_explanations import explanations, required_literal
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse, sre_constants
+
+import re
+
+c = sre_constants
+
+# characters tried for negated character classes, . and [^x]
+POOL = "ax_Z0 -'\"*(.:\n"
+
+CATEGORIES = {
+    c.CATEGORY_DIGIT: str.isdigit,
+    c.CATEGORY_NOT_DIGIT: lambda ch: not ch.isdigit(),
+    c.CATEGORY_SPACE: str.isspace,
+    c.CATEGORY_NOT_SPACE: lambda ch: not ch.isspace(),
+    c.CATEGORY_WORD: lambda ch: ch.isalnum() or ch == "_",
+    c.CATEGORY_NOT_WORD: lambda ch: not (ch.isalnum() or ch == "_"),
+}
+
+
+def in_class(ch, items):
+    """
+    return True if ch is matched by the character class items, ignoring case
+    """
+    negate = False
+    found = False
+    for op, av in items:
+        if op is c.NEGATE:
+            negate = True
+        elif op is c.LITERAL:
+            found = found or ch.lower() == chr(av).lower()
+        elif op is c.RANGE:
+            found = found or any(
+                av[0] <= ord(x) <= av[1] for x in (ch.lower(), ch.upper())
+            )
+        elif op is c.CATEGORY:
+            found = found or CATEGORIES[av](ch)
+    return found != negate
+
+
+def class_members(items):
+    if items and items[0][0] is c.NEGATE:
+        return [ch for ch in POOL if in_class(ch, items)][:3]
+    members = []
+    for op, av in items:
+        if op is c.LITERAL:
+            members.append(chr(av))
+        elif op is c.RANGE:
+            members += [chr(av[0]), chr(av[1])]
+        elif op is c.CATEGORY:
+            members += [ch for ch in POOL if CATEGORIES[av](ch)][:2]
+    return members
+
+
+def sequence_variants(pattern):
+    """
+    return token lists for a sequence of regex nodes,
+    first with every node's first variant, then varying one node at a time
+    """
+    node_variants = [node_variants_of(op, av) for op, av in pattern]
+    default = [v[0] for v in node_variants]
+    variants = [sum(default, [])]
+    for i, vs in enumerate(node_variants):
+        for v in vs[1:]:
+            variants.append(sum(default[:i] + [v] + default[i + 1 :], []))
+    return variants
+
+
+def node_variants_of(op, av):
+    """
+    return token lists for a regex node, tokens are strings,
+    group start & end markers and back-references
+    """
+    if op is c.LITERAL:
+        return [[chr(av)]]
+    if op is c.NOT_LITERAL:
+        return [[ch] for ch in POOL if ch.lower() != chr(av).lower()][:2]
+    if op is c.ANY:
+        return [["x"], ["\n"]]
+    if op is c.IN:
+        return [[ch] for ch in class_members(av)]
+    if op is c.BRANCH:
+        return [v for branch in av[1] for v in sequence_variants(branch)]
+    if op is c.SUBPATTERN:
+        group, _, _, pattern = av
+        return [
+            [("start", group)] + v + [("end", group)] if group else v
+            for v in sequence_variants(pattern)
+        ]
+    if op is getattr(c, "ATOMIC_GROUP", None):
+        return sequence_variants(av)
+    if op in (c.MAX_REPEAT, c.MIN_REPEAT, getattr(c, "POSSESSIVE_REPEAT", None)):
+        minimum, maximum, pattern = av
+        item = sequence_variants(pattern)
+        counts = [n for n in range(minimum, minimum + 3) if n <= maximum]
+        variants = []
+        for n in counts:
+            variants.append(item[0] * n)
+            if n:
+                variants += [v + item[0] * (n - 1) for v in item[1:]]
+        return variants
+    if op is c.GROUPREF:
+        return [[("ref", av)]]
+    # anchors & lookaround assertions match no characters
+    # strings where they fail are discarded below
+    return [[]]
+
+
+def generate(regex):
+    """
+    return strings generated from regex, not all will match it
+    """
+    strings = []
+    for tokens in sequence_variants(sre_parse.parse(regex, re.I | re.DOTALL)):
+        groups = {}
+        started = {}
+        text = ""
+        for token in tokens:
+            if isinstance(token, str):
+                text += token
+            elif token[0] == "start":
+                started[token[1]] = len(text)
+            elif token[0] == "end":
+                groups[token[1]] = text[started[token[1]] :]
+            else:
+                text += groups.get(token[1], "")
+        strings.append(text)
+    return strings
+
+
+def check(regex, label):
+    """
+    return the number of errors found checking regex's required literal
+    """
+    literal = required_literal(regex)
+    compiled_regex = re.compile(regex, re.I | re.DOTALL)
+    matched = [s for s in generate(regex) if compiled_regex.search(s)]
+    if not matched:
+        print(f"{label}: no strings matching {regex!r} generated", file=sys.stderr)
+        return 1
+    for s in matched:
+        if literal not in s.lower():
+            print(
+                f"{label}: {literal!r} from {regex!r} not in matching {s!r}",
+                file=sys.stderr,
+            )
+            return 1
+    return 0
+
+
+# regex, the literal expected
+EDGE_CASES = [
+    (r"abc|def", ""),
+    (r"(abc|def)ghij", "ghij"),
+    (r"ab(c|d)efg", "efg"),
+    (r"(?:abc|xy)+defg", "defg"),
+    (r"abc(defgh)?ij", "abc"),
+    (r"(?:abcd)?efg", "efg"),
+    (r"colou?r", "colo"),
+    (r"abcd*ef", "abc"),
+    (r"abc+de", "abc"),
+    (r"ab{2,3}cde", "cde"),
+    (r"abcd*?", "abc"),
+    (r"[|(]abcd[)x]ef", "abcd"),
+    (r"[]|]abc|d", ""),
+    (r"[^]|]+abcd", "abcd"),
+    (r"[a-z]+ expected", " expected"),
+    (r"\(abc\)\d+", "(abc)"),
+    (r"\bWord\b.*\S", "word"),
+    (r"x'(\w+)' and '\1'", "' and '"),
+    (r"^at start$", "at start"),
+    (r"a.b.c", "a"),
+]
+
+n_errors = 0
+for regex, expected in EDGE_CASES:
+    literal = required_literal(regex)
+    if literal != expected:
+        print(
+            f"required_literal({regex!r}) == {literal!r}, expected {expected!r}",
+            file=sys.stderr,
+        )
+        n_errors += 1
+    n_errors += check(regex, "edge case")
+
+for explanation in explanations:
+    if explanation.regex:
+        n_errors += check(explanation.regex, explanation.label)
+
+if n_errors:
+    sys.exit(1)
+eof
+
+echo All Tests Correct 1>&2
@@ -0,0 +1,132 @@
+#!/bin/bash
+# check the diagnostics clang writes with --serialize-diagnostics are decoded correctly
+#
+# serialized_diagnostics/diagnostics.dia was written by clang 14.0.6
+# (Debian libclang-cpp14 1:14.0.6-12) and can be regenerated with:
+#   cd serialized_diagnostics
+#   clang -Wall -c diagnostics.c --serialize-diagnostics diagnostics.dia -o /dev/null
+# clang's own headers were not installed, so these were supplied with
+#   -isystem /usr/lib/gcc/x86_64-linux-gnu/12/include
+
+dcc=${dcc:-./dcc}
+
+python3 - "$dcc" <<'eof' || exit 1
+import sys
+
+# dcc's modules are imported from the zipapp
+sys.path.insert(0, sys.argv[1])
+from serialized_diagnostics import read_serialized_diagnostics
+
+
+def fields(d):
+    return (d.type, d.filename, d.line, d.column, d.text, d.flag, d.ranges)
+
+
+pathname = "serialized_diagnostics/diagnostics.dia"
+diagnostics = read_serialized_diagnostics(pathname)
+if diagnostics is None:
+    print(f"can not decode {pathname}", file=sys.stderr)
+    sys.exit(1)
+
+expected = [
+    (
+        (
+            "warning",
+            "./diagnostics.h",
+            2,
+            9,
+            "unused variable 'unused'",
+            "-Wunused-variable",
+            [],
+        ),
+        [
+            # clang writes this note before the diagnostic it is for
+            (
+                "note",
+                "diagnostics.c",
+                2,
+                10,
+                "in file included from diagnostics.c:2:",
+                "",
+                [],
+            ),
+        ],
+    ),
+    (
+        (
+            "warning",
+            "diagnostics.c",
+            6,
+            15,
+            "using the result of an assignment as a condition without parentheses",
+            "-Wparentheses",
+            [(6, 9, 6, 18)],
+        ),
+        [
+            (
+                "note",
+                "diagnostics.c",
+                6,
+                15,
+                "place parentheses around the assignment to silence this warning",
+                "",
+                [(6, 9, 6, 9), (6, 18, 6, 18)],
+            ),
+            (
+                "note",
+                "diagnostics.c",
+                6,
+                15,
+                "use '==' to turn this assignment into an equality comparison",
+                "",
+                [(6, 15, 6, 16)],
+            ),
+        ],
+    ),
+    (
+        (
+            "warning",
+            "diagnostics.c",
+            7,
+            24,
+            "format specifies type 'char *' but the argument has type 'int'",
+            "-Wformat",
+            [(7, 24, 7, 29), (7, 17, 7, 19), (7, 17, 7, 19)],
+        ),
+        [],
+    ),
+    (
+        (
+            "error",
+            "diagnostics.c",
+            9,
+            12,
+            "use of undeclared identifier 'total'",
+            "",
+            [],
+        ),
+        [],
+    ),
+]
+
+actual = [(fields(d), [fields(n) for n in d.notes]) for d in diagnostics]
+if actual != expected:
+    print("decoded diagnostics differ from expected:", file=sys.stderr)
+    for diagnostic in actual:
+        print(diagnostic, file=sys.stderr)
+    sys.exit(1)
+
+with open(pathname, "rb") as f:
+    data = f.read()
+with open("tmp.dia", "wb") as f:
+    f.write(data[: len(data) // 2])
+if read_serialized_diagnostics("tmp.dia") is not None:
+    print("truncated file not rejected", file=sys.stderr)
+    sys.exit(1)
+
+if read_serialized_diagnostics("tmp_missing.dia") != []:
+    print("missing file not treated as no diagnostics", file=sys.stderr)
+    sys.exit(1)
+eof
+
+echo All Tests Correct 1>&2
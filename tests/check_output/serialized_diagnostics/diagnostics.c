@@ -0,0 +1,10 @@
+#include <stdio.h>
+#include "diagnostics.h"
+
+int main(void) {
+    int count = 42;
+    if (count = 1) {
+        printf("%s\n", count);
+    }
+    return total;
+}
@@ -0,0 +1,4 @@
+int header_function(void) {
+    int unused;
+    return 0;
+}
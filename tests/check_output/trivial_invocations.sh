@@ -0,0 +1,74 @@
+#!/bin/bash
+# check dcc --version and dcc -c do no unnecessary work,
+# i.e. don't create the tar archive of source files or run programs to probe the toolchain
+# a real dcc -c is profiled to check it runs only the compiler
+
+dcc=${dcc:-./dcc}
+
+export DCC_CACHE_DIR="$(pwd)/tmp_cache" DCC_NO_SERVER=1
+
+cat >tmp.c <<eof
+int main(void) {return 0;}
+eof
+
+# save the toolchain probe results
+$dcc -c tmp.c 2>/dev/null || exit
+
+python3 - "$dcc" <<'eof' || exit 1
+import contextlib, io, subprocess, sys, tarfile
+
+# dcc's modules are imported from the zipapp
+sys.path.insert(0, sys.argv[1])
+import options
+
+
+def fail(*args, **kwargs):
+    raise AssertionError("unnecessary work")
+
+
+for f in ["run", "Popen", "check_output"]:
+    setattr(subprocess, f, fail)
+tarfile.open = fail
+
+o = options.Options()
+lazy_attributes = ["probe", "include_index", "also_run_gcc", "compile_helper"]
+if any(a in vars(o) for a in lazy_attributes):
+    print("Options() did unnecessary work", file=sys.stderr)
+    sys.exit(1)
+
+try:
+    options.parse_args(["--version"])
+except SystemExit as e:
+    if e.code:
+        sys.exit(1)
+
+sys.argv = ["dcc", "-c", "tmp.c"]
+# discard the warning about incremental compilation
+with contextlib.redirect_stderr(io.StringIO()):
+    o = options.get_options()
+if not o.incremental_compilation:
+    sys.exit(1)
+eof
+
+rm -f tmp.o
+DCC_PROFILE="$(pwd)/tmp_profile.json" $dcc -c tmp.c 2>/dev/null || exit
+test -s tmp.o || exit 1
+
+python3 - tmp_profile.json <<'eof' || exit 1
+import json, sys
+
+with open(sys.argv[1], encoding="utf-8") as f:
+    phases = json.load(f)["phases"]
+
+commands = [p["command"] for p in phases if p["name"] == "subprocess"]
+if len(commands) != 1 or "-c" not in commands[0] or "tmp.c" not in commands[0]:
+    print("dcc -c ran unnecessary programs:", commands, file=sys.stderr)
+    sys.exit(1)
+
+archive_phases = ["get_wrapper_code", "source_for_embedded_tarfile", "embed_data_file"]
+if any(p["name"] in archive_phases for p in phases):
+    print("dcc -c built the tar archive of source files", file=sys.stderr)
+    sys.exit(1)
+eof
+
+echo All Tests Correct 1>&2
@@ -0,0 +1,8 @@
+//dcc_flags=
+//dcc_flags=--structured-diagnostics
+//dcc_flags="--structured-diagnostics -fno-diagnostics-show-option"
+int main(void) {
+    int grid[3][3] = {0};
+    grid[1, 2][0] = 1;
+    return grid[2][0];
+}
@@ -1,2 +1,4 @@
+//dcc_flags=
+//dcc_flags=-fuse-ld=lld
 int man(int argc, char *argv[]) {
 }
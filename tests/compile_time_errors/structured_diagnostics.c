@@ -0,0 +1,11 @@
+//dcc_flags=
+//dcc_flags=--structured-diagnostics
+#include <stdio.h>
+
+int main(void) {
+    int count = 42;
+    if (count = 1) {
+        printf("%s\n", count);
+    }
+    return total;
+}
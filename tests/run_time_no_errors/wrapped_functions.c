@@ -0,0 +1,28 @@
+//dcc_flags=
+//dcc_flags=-fuse-ld=bfd
+// dcc wraps main, fileno, fopen & other functions using the linker's -wrap option
+// check these resolve correctly with the linker dcc selects & with the default linker
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+int main(void) {
+    FILE *f = fopen("tmp_wrapped_functions.txt", "w");
+    if (f == NULL || fileno(f) < 3) {
+        return 1;
+    }
+    fprintf(f, "hello\n");
+    fclose(f);
+
+    char line[16];
+    f = fopen("tmp_wrapped_functions.txt", "r");
+    if (f == NULL || fgets(line, sizeof line, f) == NULL) {
+        return 1;
+    }
+    fclose(f);
+    remove("tmp_wrapped_functions.txt");
+    printf("%s", line);
+    printf("%d\n", fileno(stdout));
+    printf("%d\n", time(NULL) > 0);
+    return 0;
+}
@@ -62,6 +62,7 @@ void __dcc_error_exit(void) NO_SANITIZE;
 static void __dcc_signal_handler(int signum) NO_SANITIZE;
 static void set_signals_default(void) NO_SANITIZE;
 static void launch_valgrind(int argc, char *argv[]) NO_SANITIZE;
+static void write_tar_data(FILE *f) NO_SANITIZE;
 static void setenvd_int(const char *n, int v) NO_SANITIZE;
 static void setenvd(const char *n, const char *v) NO_SANITIZE;
 static void putenvd(const char *s) NO_SANITIZE;
@@ -156,9 +157,9 @@ int __wrap_main(int argc, char *argv[], char *envp[]) {
 	}
 	chmod(sanitizer2_executable_pathname, S_IRWXU);
 	setenvd("DCC_UNLINK", sanitizer2_executable_pathname);
-	int n_bytes_written = write(sanitizer2_executable_fd, sanitizer2_executable, __EXECUTABLE_N_BYTES__);
-	if (n_bytes_written != __EXECUTABLE_N_BYTES__) {
-		debug_printf(1, "write sanitizer2_executable %d != %d\n", n_bytes_written, __EXECUTABLE_N_BYTES__);
+	int n_bytes_written = write(sanitizer2_executable_fd, sanitizer2_executable, sanitizer2_executable_n_bytes);
+	if (n_bytes_written != (int)sanitizer2_executable_n_bytes) {
+		debug_printf(1, "write sanitizer2_executable %d != %d\n", n_bytes_written, (int)sanitizer2_executable_n_bytes);
 		__dcc_error_exit();
 	}
 	close(sanitizer2_executable_fd);
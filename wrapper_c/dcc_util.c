@@ -4,6 +4,8 @@
 
 static void launch_valgrind(int argc, char *argv[]) {
     debug_printf(2, "command=%s\n", "__MONITOR_VALGRIND__");
+    // the watcher reads exactly this many bytes, valgrind's errors follow them
+    setenvd_int("DCC_TAR_N_BYTES", (int)(runtime_tar_data_n_bytes + tar_data_n_bytes));
 #if __N_SANITIZERS__ > 1
     extern FILE *__real_popen(const char *command, const char *type);
     FILE *valgrind_error_pipe = __real_popen("__MONITOR_VALGRIND__", "w");
@@ -12,8 +14,7 @@ static void launch_valgrind(int argc, char *argv[]) {
 #endif
     int valgrind_error_fd = 2;
     if (valgrind_error_pipe) {
-        fwrite(tar_data, sizeof tar_data[0],
-               sizeof tar_data / sizeof tar_data[0], valgrind_error_pipe);
+        write_tar_data(valgrind_error_pipe);
         fflush(valgrind_error_pipe);
         setbuf(valgrind_error_pipe, NULL);
         extern int __real_fileno(FILE *stream);
@@ -257,6 +258,18 @@ static void __dcc_signal_handler(int signum) {
     _explain_error(); // not reached
 }
 
+// the embedded data is two xz-compressed tar archives
+// the first contains dcc's run-time Python, the second the user's source files
+static void write_tar_data(FILE *f) {
+    size_t n_bytes = runtime_tar_data_n_bytes + tar_data_n_bytes;
+    size_t bytes_written = fwrite(runtime_tar_data, 1, runtime_tar_data_n_bytes, f);
+    bytes_written += fwrite(tar_data, 1, tar_data_n_bytes, f);
+    if (bytes_written != n_bytes) {
+        debug_printf(1, "fwrite bad return %d returned %d expected\n",
+                     (int)bytes_written, (int)n_bytes);
+    }
+}
+
 static const char *run_tar_file =
     "PATH=$PATH:/bin:/usr/bin:/usr/local/bin exec python3 -B -E -c \"import io,os,sys,tarfile,tempfile\n\
 with tempfile.TemporaryDirectory() as temp_dir:\n\
@@ -265,7 +278,7 @@ with tempfile.TemporaryDirectory() as temp_dir:\n\
   if not buffer_length:\n\
     sys.exit(1)\n\
   k = {'filter':'data'} if hasattr(tarfile, 'data_filter') else {}\n\
-  tarfile.open(fileobj=buffer, bufsize=buffer_length, mode='r|xz').extractall(temp_dir, **k)\n\
+  tarfile.open(fileobj=buffer, mode='r:xz', ignore_zeros=True).extractall(temp_dir, **k)\n\
   os.environ['DCC_PWD'] = os.getcwd()\n\
   os.chdir(temp_dir)\n\
   exec(open('start_gdb.py').read())\n\
@@ -294,13 +307,7 @@ static void _explain_error(void) {
 #else
     FILE *python_pipe = popen(run_tar_file, "w");
 #endif
-    size_t n_items = sizeof tar_data / sizeof tar_data[0];
-    size_t items_written =
-        fwrite(tar_data, sizeof tar_data[0], n_items, python_pipe);
-    if (items_written != n_items) {
-        debug_printf(1, "fwrite bad return %d returned %d expected\n",
-                     (int)items_written, (int)n_items);
-    }
+    write_tar_data(python_pipe);
     pclose(python_pipe);
     __dcc_error_exit();
 }